@@ -0,0 +1,266 @@
+#!/usr/bin/python
+
+import os
+import sys
+import time
+import tempfile
+import optparse
+import lampy
+
+def make_db(fn, nobjs, verbs=3, props=2):
+    """Write a synthetic Format Version 4 database of nobjs objects,
+    arranged as a four-way inheritance tree with every fifth object a
+    room holding the four after it."""
+    parent = lambda i: (i - 1) // 4 if i else -1
+    children = lambda i: [c for c in range(4 * i + 1, 4 * i + 5) if c < nobjs]
+    room = lambda i: i - i % 5
+    depth = [0] * nobjs
+    for i in range(1, nobjs):
+        depth[i] = depth[parent(i)] + 1
+    f = open(fn, 'w')
+    w = f.write
+    w('** LambdaMOO Database, Format Version 4 **\n')
+    w('%d\n%d\n0\n1\n2\n' % (nobjs, nobjs * verbs))
+    for i in range(nobjs):
+        kids = children(i)
+        siblings = children(parent(i)) if i else [0]
+        sibling = siblings[siblings.index(i) + 1] if siblings[-1] != i else -1
+        if i % 5:
+            location = room(i)
+            contents = -1
+            nxt = i + 1 if i % 5 != 4 and i + 1 < nobjs else -1
+        else:
+            location = -1
+            contents = i + 1 if i + 1 < nobjs else -1
+            nxt = -1
+        w('#%d\nObject %d\n\n%d\n2\n%d\n%d\n%d\n%d\n%d\n%d\n' % (
+            i, i, 7 if i == 2 else 0, location, contents, nxt, parent(i),
+            kids[0] if kids else -1, sibling))
+        w('%d\n' % verbs)
+        for v in range(verbs):
+            w('verb%d_%d v%d*alias\n2\n173\n-1\n' % (i, v, v))
+        w('%d\n' % props)
+        for p in range(props):
+            w('prop%d_%d\n' % (i, p))
+        w('%d\n' % (props * (depth[i] + 1)))
+        for p in range(props):
+            if p % 2:
+                w('4\n3\n0\n%d\n2\nsome text\n4\n0\n2\n5\n' % i)
+            else:
+                w('2\nThe description of object %d.\n2\n5\n' % i)
+        for p in range(props * depth[i]):
+            w('5\n2\n5\n')
+    for i in range(nobjs):
+        for v in range(verbs):
+            w('#%d:%d\n' % (i, v))
+            w('x = args[1];\nif (x > %d)\n  return this.prop%d_0;\n'
+              'endif\nreturn {x, "%d"};\n.\n' % (v, i, v))
+    w('0 clocks\n0 queued tasks\n0 suspended tasks\n')
+    f.close()
+
+def best_of(func, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.time()
+        func()
+        times.append(time.time() - start)
+    return min(times)
+
+def bench_load(fn, options):
+    for reader in sorted(lampy.moo.dbio.Readers):
+        def load():
+            lampy.moo.db.LambdaMooDB(fn, reader=reader).parse()
+        print '%-8s %8.3fs' % (reader, best_of(load, options['repeat']))
+
+def bench_snapshot(fn, options):
+    def parse():
+        lampy.moo.db.LambdaMooDB(fn).parse()
+    def load():
+        lampy.moo.db.LambdaMooDB(fn).load()
+    snapfn = lampy.moo.snapshot.snapshot_filename(fn)
+    print '%-8s %8.3fs' % ('parse', best_of(parse, options['repeat']))
+    load()
+    try:
+        print '%-8s %8.3fs' % ('snapshot', best_of(load, options['repeat']))
+    finally:
+        os.unlink(snapfn)
+
+def bench_write(fn, options):
+    db = lampy.moo.db.LambdaMooDB(fn)
+    db.parse()
+    outfn = fn + '.out'
+    def write():
+        db.write(outfn)
+    try:
+        print '%-8s %8.3fs' % ('write', best_of(write, options['repeat']))
+        same = open(outfn, 'rb').read() == open(fn, 'rb').read()
+        print '%-8s %8s' % ('same', same)
+    finally:
+        os.unlink(outfn)
+
+def bench_checkpoint(fn, options):
+    db = lampy.moo.db.LambdaMooDB(fn)
+    db.parse()
+    deltafn = lampy.moo.checkpoint.delta_filename(fn)
+    def checkpoint():
+        for objid in sorted(db.objects)[:10]:
+            db.mark_dirty(objid)
+        db.checkpoint()
+    try:
+        print '%-10s %8.3fs' % ('checkpoint', best_of(checkpoint,
+                                                       options['repeat']))
+        print '%-10s %8d bytes' % ('delta', os.path.getsize(deltafn))
+    finally:
+        os.unlink(deltafn)
+
+def bench_textindex(fn, options):
+    db = lampy.moo.db.LambdaMooDB(fn)
+    db.parse()
+    indexfn = lampy.moo.textindex.text_index_filename(fn)
+    def build():
+        lampy.moo.textindex.VerbTextIndex.build(db)
+    def load():
+        lampy.moo.textindex.load_text_index(db)
+    def grep():
+        [verb for obj in db.objects.itervalues() for verb in obj.verbs
+         if 'this.prop7_0' in verb.body]
+    def search():
+        db.search_verbs('this.prop7_0')
+    try:
+        print '%-8s %8.3fs' % ('build', best_of(build, options['repeat']))
+        db.get_text_index()
+        print '%-8s %8.3fs' % ('load', best_of(load, options['repeat']))
+        print '%-8s %8.3fs' % ('scan', best_of(grep, options['repeat']))
+        print '%-8s %8.3fs' % ('search', best_of(search, options['repeat']))
+    finally:
+        os.unlink(indexfn)
+
+def bench_parallel(fn, options):
+    for workers in (1, 2, 4, 8, 16):
+        def load():
+            lampy.moo.db.LambdaMooDB(fn, reader='mmap').parse(workers=workers)
+        print '%2d workers %8.3fs' % (workers,
+                                      best_of(load, options['repeat']))
+
+def recursive_parse_variable(db):
+    """LambdaMooDB.parse_variable() as it was before the explicit-stack
+    decoder, kept as the baseline for bench_values."""
+    _typ = int(db.db.readline())
+    if _typ == 0:
+        return int(db.db.readline())
+    if _typ in (1, 2, 3, 7, 8):
+        return db.db.readline().strip()
+    if _typ == 9:
+        return float(db.db.readline())
+    if _typ == 4:
+        _len = int(db.db.readline())
+        return [recursive_parse_variable(db) for x in range(_len)]
+    return None
+
+def bench_values(fn, options):
+    # list-heavy property values, like the exits, aliases and message
+    # lists of a LambdaCore database; fn is not used
+    count = options['objects'] * 5
+    value = ('4\n6\n1\n%d\n2\nsome text\n0\n42\n'
+             '4\n3\n2\nnorth\n1\n7\n3\n4\n9\n1.5\n4\n0\n')
+    tmp = tempfile.NamedTemporaryFile(suffix='.values', delete=False)
+    for i in range(count):
+        tmp.write(value % i)
+    tmp.close()
+    try:
+        for label, decode in (('recursive', recursive_parse_variable),
+                              ('stack', lampy.moo.db.LambdaMooDB.parse_variable)):
+            def load():
+                db = lampy.moo.db.LambdaMooDB(tmp.name)
+                for _idx in xrange(count):
+                    decode(db)
+            elapsed = best_of(load, options['repeat'])
+            print '%-10s %8.3fs %10d values/s' % (label, elapsed, count / elapsed)
+    finally:
+        os.unlink(tmp.name)
+
+def bench_hashcons(fn, options):
+    for hashcons in (False, True):
+        def load():
+            lampy.moo.db.LambdaMooDB(fn, hashcons=hashcons).parse()
+        print '%-9s %8.3fs' % (hashcons and 'hashcons' or 'plain',
+                               best_of(load, options['repeat']))
+    db = lampy.moo.db.LambdaMooDB(fn, hashcons=True)
+    db.parse()
+    print db.pool.report()
+
+class DictRecord(object):
+    """Stand-in for the record classes as they were before __slots__,
+    holding the same fields in a per-instance __dict__."""
+    def __init__(self, record):
+        for key in record.__slots__:
+            value = getattr(record, key)
+            if value is not None:
+                self.__dict__[key] = value
+
+def record_size(record):
+    size = sys.getsizeof(record)
+    if hasattr(record, '__dict__'):
+        size += sys.getsizeof(record.__dict__)
+    return size
+
+def object_size(obj, wrap=lambda record: record):
+    size = record_size(wrap(obj))
+    size += sum([record_size(wrap(verb)) for verb in obj.verbs])
+    size += sum([record_size(wrap(prop)) for prop in obj.properties])
+    return size
+
+def bench_memory(fn, options):
+    db = lampy.moo.db.LambdaMooDB(fn)
+    db.parse()
+    count = len(db.objects)
+    before = sum([object_size(obj, DictRecord) for obj in db.objects.values()])
+    after = sum([object_size(obj) for obj in db.objects.values()])
+    print 'bytes per object, verbs and properties included,'
+    print 'not counting the field values themselves:'
+    print '%-8s %8d' % ('__dict__', before / count)
+    print '%-8s %8d' % ('__slots__', after / count)
+
+Benchmarks = {
+    'memory' : bench_memory,
+    'hashcons' : bench_hashcons,
+    'load' : bench_load,
+    'parallel' : bench_parallel,
+    'values' : bench_values,
+    'snapshot' : bench_snapshot,
+    'write' : bench_write,
+    'checkpoint' : bench_checkpoint,
+    'textindex' : bench_textindex,
+}
+
+def get_cli():
+    parser = optparse.OptionParser(usage="%prog [options] " +
+                                   '|'.join(sorted(Benchmarks)))
+    parser.add_option("-d", "--db", dest="dbfilename",
+                      help="Moo database file to benchmark against")
+    parser.add_option("-n", "--objects", dest="objects", type="int",
+                      default=100000,
+                      help="Size of the synthetic database used without --db")
+    parser.add_option("-r", "--repeat", dest="repeat", type="int", default=3,
+                      help="Report the best of this many runs")
+    (options, args) = parser.parse_args()
+    if len(args) != 1 or args[0] not in Benchmarks:
+        parser.error("choose one of: %s" % ', '.join(sorted(Benchmarks)))
+    options = eval(str(options))
+    return (options, args)
+
+if __name__ == '__main__':
+    options, args = get_cli()
+    fn = options['dbfilename']
+    tmp = None
+    if not fn:
+        tmp = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+        tmp.close()
+        fn = tmp.name
+        make_db(fn, options['objects'])
+    print '%s: %.1f MB' % (fn, os.path.getsize(fn) / 1048576.0)
+    try:
+        Benchmarks[args[0]](fn, options)
+    finally:
+        if tmp:
+            os.unlink(fn)
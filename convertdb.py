@@ -1,7 +1,40 @@
 #!/usr/bin/python
 
+import os
+import sys
+import json
+import math
+import hashlib
 import lampy
 import optparse 
+import threading
+import collections
+import multiprocessing
+from itertools import islice
+
+# verbs handed to a worker at a time, and batches in flight per worker
+BatchSize = 32
+BatchesPerWorker = 4
+
+# each worker process builds its parser once, in init_worker()
+worker_parser = None
+
+ManifestVersion = 1
+
+ManifestName = 'manifest.json'
+
+ReportVersion = 1
+
+# verbs listed by name in a report as the slowest to convert
+SlowestCount = 50
+
+# write buffer of each generated module
+ModuleBufferSize = 64 << 10
+
+# the arguments of a converted verb, MOO's built-in verb variables
+VerbArguments = "this, player=None, caller=None, verb=None, args=(), " \
+                "argstr='', dobj=None, dobjstr='', prepstr='', iobj=None, " \
+                "iobjstr=''"
 
 def indent(_str, level=1, spaces=4):
     if not _str.strip():
@@ -18,44 +51,516 @@ def shift(txt, level=1, spaces=4):
         _txt += line + '\n'
     return _txt
 
+def convert_verb_body(parser, body):
+    body = lampy.compiler.cache.normalize_body(body)
+    ast = parser.parse(body)
+    return ast.generate()
+
+def body_hash(body):
+    return hashlib.sha1(lampy.compiler.cache.normalize_body(body)).hexdigest()
+
+def verb_filename(objid, verbid):
+    return os.path.join(str(objid), '%d.py' % verbid)
+
+def format_verb(verb, pycode):
+    """The text emitted for one verb: its name and aliases, its perms
+    and owner, then the generated code."""
+    names = verb.name.split(' ')
+    verb_name = names[0]
+    verb_aliases = names[1:]
+    return '%s %s\n%s %s\n%s\n' % (verb_name, verb_aliases, verb.perms,
+                                     verb.owner_id, pycode)
+
+def load_manifest(fn):
+    """The verbs entry of a conversion manifest, or an empty one when
+    fn does not exist or was made by another compiler, so that every
+    verb is converted again."""
+    try:
+        f = open(fn)
+    except IOError:
+        return {}
+    try:
+        manifest = json.load(f)
+    finally:
+        f.close()
+    if manifest.get('version') != ManifestVersion or \
+            manifest.get('compiler') != lampy.compiler.cache.compiler_version():
+        return {}
+    return manifest['verbs']
+
+def save_manifest(fn, verbs):
+    tmp = fn + '.tmp'
+    try:
+        f = open(tmp, 'w')
+        try:
+            json.dump({'version' : ManifestVersion,
+                       'compiler' : lampy.compiler.cache.compiler_version(),
+                       'verbs' : verbs}, f, sort_keys=True, indent=0)
+        finally:
+            f.close()
+    except:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    os.rename(tmp, fn)
+
+def module_name(objid):
+    return 'o%d' % objid
+
+def has_statements(pycode):
+    for line in pycode.split('\n'):
+        line = line.strip()
+        if line and not line.startswith('#'):
+            return True
+    return False
+
+class PackageWriter(object):
+    """Writes converted objects as a Python package under path, one
+    module o<objid>.py per object, imported by get_object(objid)."""
+    def __init__(self, path, source=None):
+        self.path = path
+        self.source = source
+        self.pending = collections.deque()
+        self.objids = []
+        self.current = None
+        self.current_id = None
+        self.functions = []
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    def track(self, objects):
+        for obj in objects:
+            self.pending.append((obj.id, obj.name, obj.parent_id,
+                                 obj.owner_id, obj.location_id))
+            yield obj
+
+    def write_verb(self, objid, verbid, verb, pycode):
+        while self.current_id != objid:
+            self.next_module()
+        function = 'verb_%d' % verbid
+        if not has_statements(pycode):
+            pycode += '\npass'
+        self.current.write(''.join([
+            '\ndef %s(%s):\n' % (function, VerbArguments),
+            shift(pycode).rstrip() + '\n',
+            '%s.names = %r\n' % (function, verb.name.split(' ')),
+            '%s.perms = %d\n' % (function, verb.perms),
+            '%s.owner = %d\n' % (function, verb.owner_id)]))
+        self.functions.append(function)
+
+    def next_module(self):
+        """Finish the module being written and start the next one."""
+        self.close_module()
+        objid, name, parent, owner, location = self.pending.popleft()
+        fn = os.path.join(self.path, module_name(objid) + '.py')
+        self.current = open(fn, 'w', ModuleBufferSize)
+        self.current_id = objid
+        self.objids.append(objid)
+        self.current.write(''.join([
+            '# Converted from %s\n' % self.source,
+            'from lampy import moo\n\n',
+            'id = %d\n' % objid,
+            'name = %r\n' % name,
+            'parent = %d\n' % parent,
+            'owner = %d\n' % owner,
+            'location = %d\n' % location]))
+
+    def close_module(self):
+        if self.current is None:
+            return
+        self.current.write('\nverbs = [%s]\n' % ', '.join(self.functions))
+        self.current.close()
+        self.current = None
+        self.functions = []
+
+    def close(self):
+        """Write out the objects left, the package index, and remove
+        the modules of objects that are not in the package any more."""
+        while self.pending:
+            self.next_module()
+        self.close_module()
+        written = set([module_name(objid) for objid in self.objids])
+        for fn in os.listdir(self.path):
+            module, ext = os.path.splitext(fn)
+            if module.startswith('o') and module[1:].isdigit() and \
+                    ext in ('.py', '.pyc', '.pyo') and module not in written:
+                os.remove(os.path.join(self.path, fn))
+        f = open(os.path.join(self.path, '__init__.py'), 'w', ModuleBufferSize)
+        try:
+            f.write('"""Objects converted from %s."""\n' % self.source)
+            f.write('import importlib\n\nObjects = {\n')
+            for objid in self.objids:
+                f.write('    %d : %r,\n' % (objid, module_name(objid)))
+            f.write('}\n\ndef get_object(objid):\n'
+                    '    return importlib.import_module(\n'
+                    '        \'%s.%s\' % (__name__, Objects[objid]))\n')
+        finally:
+            f.close()
+
+def percentiles(values):
+    values = sorted(values)
+    if not values:
+        return None
+    ranks = {}
+    for point in (50, 90, 99):
+        rank = int(math.ceil(point / 100.0 * len(values))) - 1
+        ranks['p%d' % point] = values[max(rank, 0)]
+    ranks['max'] = values[-1]
+    return ranks
+
+def write_report(fn, records):
+    """Write the conversion records as a JSON report: a summary, the
+    slowest verbs, the failures, and every record."""
+    records.sort(key=lambda record: (record['object'], record['verb']))
+    compiled = [record for record in records if not record['cached']]
+    failed = [record for record in compiled if record['error'] is not None]
+    summary = {'verbs' : len(records), 'compiled' : len(compiled),
+               'cached' : len(records) - len(compiled),
+               'failed' : len(failed),
+               'size' : sum([record['size'] for record in records])}
+    for stage in ('lex', 'parse', 'codegen', 'total'):
+        times = [record[stage] for record in compiled]
+        summary[stage] = {'seconds' : sum(times),
+                          'percentiles' : percentiles(times)}
+    # failed verbs have no output to measure
+    summary['size_percentiles'] = percentiles([record['size']
+                                               for record in compiled
+                                               if record['error'] is None])
+    slowest = sorted(compiled, key=lambda record: record['total'],
+                     reverse=True)[:SlowestCount]
+    tmp = fn + '.tmp'
+    f = open(tmp, 'w')
+    try:
+        json.dump({'version' : ReportVersion, 'summary' : summary,
+                   'slowest' : slowest, 'failures' : failed,
+                   'verbs' : records}, f, sort_keys=True, indent=1)
+    finally:
+        f.close()
+    os.rename(tmp, fn)
+    return summary
+
+def init_worker():
+    global worker_parser
+    worker_parser = lampy.compiler.build_parser()
+
+def convert_batch(batch):
+    """Worker side: convert a list of (objid, verbid, body), returning
+    (objid, verbid, pycode) in the same order."""
+    return [(objid, verbid, convert_verb_body(worker_parser, body))
+            for objid, verbid, body in batch]
+
+def profile_batch(batch):
+    """Worker side of a conversion with a report: as convert_batch(),
+    returning (objid, verbid, pycode, record) from compile_timed()."""
+    return [(objid, verbid) +
+            lampy.compiler.timing.compile_timed(worker_parser, body)
+            for objid, verbid, body in batch]
+
+class Batch(dict):
+    """Verbs sent to the workers together, mapping (objid, verbid) to
+    (verb, body); order lists (objid, verbid, verb, body)."""
+    def __init__(self, verbs):
+        dict.__init__(self)
+        self.order = []
+        for objid, verbid, verb in verbs:
+            body = verb.body
+            self.order.append((objid, verbid, verb, body))
+            self[(objid, verbid)] = (verb, body)
+
 class Converter(object):
-    def __init__(self, fn):
+    """Converts every verb of a database, printing the results, or
+    writing them under output, incrementally, or as a package, with a
+    timing report when report is set."""
+    def __init__(self, fn, cache=False, jobs=1, compile_cache=None,
+                 output=None, manifest=None, package=None, report=None):
         self.db = lampy.moo.db.LambdaMooDB(fn)
-        self.db.parse()
-        lcnt = rcnt = 0
-        for objid in self.db.objects:
-            self.convert_object(objid)
-
-    def convert_object(self, objid):
-        obj = self.db.objects[objid]
-        for verb in obj.verbs:
-            if not hasattr(verb, 'body'):
+        self.parser = None
+        self.compile_cache = compile_cache
+        self.output = output
+        self.package = None
+        self.records = None
+        if report is not None:
+            self.records = []
+        self.summary = None
+        self.counts = {'added' : 0, 'changed' : 0, 'unchanged' : 0,
+                       'deleted' : 0}
+        if cache:
+            self.db.load()
+            objects = (self.db.objects[objid] for objid in sorted(self.db.objects))
+        else:
+            objects = self.db.iter_objects()
+        if package is not None:
+            self.package = PackageWriter(package, fn)
+            objects = self.package.track(objects)
+        verbs = self.iter_verbs(objects)
+        if output is not None:
+            if manifest is None:
+                manifest = os.path.join(output, ManifestName)
+            self.previous = load_manifest(manifest)
+            self.manifest = {}
+            verbs = self.changed_verbs(verbs)
+        if jobs > 1:
+            self.convert_parallel(verbs, jobs)
+        else:
+            self.convert_verbs(verbs)
+        if output is not None:
+            self.finish_output()
+        if self.package is not None:
+            self.package.close()
+        if report is not None:
+            self.summary = write_report(report, self.records)
+
+    def iter_verbs(self, objects):
+        for obj in objects:
+            for verbid, verb in enumerate(obj.verbs):
+                if not hasattr(verb, 'body'):
+                    continue
+                yield (obj.id, verbid, verb)
+
+    def changed_verbs(self, verbs):
+        """Record every verb in the new manifest, passing on only those
+        whose output has to be made again."""
+        for objid, verbid, verb in verbs:
+            key = '%d:%d' % (objid, verbid)
+            # MOO strings are bytes; latin-1 maps them to text one to one
+            entry = {'hash' : body_hash(verb.body),
+                     'names' : verb.name.decode('latin-1'),
+                     'owner' : verb.owner_id, 'perms' : verb.perms,
+                     'file' : verb_filename(objid, verbid)}
+            self.manifest[key] = entry
+            old = self.previous.get(key)
+            if old is None:
+                self.counts['added'] += 1
+            elif old == entry and \
+                    os.path.exists(os.path.join(self.output, entry['file'])):
+                self.counts['unchanged'] += 1
                 continue
-            pycode = self.convert_verb_body(verb.body)
-            names = verb.name.split(' ')
-            verb_name = names[0]
-            verb_aliases = names[1:]
-            print verb_name, verb_aliases
-            print verb.perms, verb.owner_id
-            print pycode
+            else:
+                self.counts['changed'] += 1
+            yield (objid, verbid, verb)
+
+    def finish_output(self):
+        """Delete the files of verbs that no longer exist and save the
+        new manifest."""
+        for key, old in self.previous.iteritems():
+            if key in self.manifest:
+                continue
+            fn = os.path.join(self.output, old['file'])
+            if os.path.exists(fn):
+                os.remove(fn)
+                try:
+                    os.rmdir(os.path.dirname(fn))
+                except OSError:
+                    pass
+            self.counts['deleted'] += 1
+        save_manifest(os.path.join(self.output, ManifestName), self.manifest)
+
+    def report(self):
+        return '%(added)d added, %(changed)d changed, %(unchanged)d ' \
+               'unchanged, %(deleted)d deleted verbs' % self.counts
+
+    def convert_object(self, obj):
+        self.convert_verbs(self.iter_verbs([obj]))
+
+    def convert_verbs(self, verbs):
+        for objid, verbid, verb in verbs:
+            self.emit(objid, verbid, verb,
+                      self.convert_verb(objid, verbid, verb))
+
+    def convert_verb(self, objid, verbid, verb):
+        if self.records is None:
+            return self.convert_verb_body(verb.body)
+        pycode = self.cache_get(verb.body)
+        if pycode is not None:
+            self.add_record(objid, verbid, verb, None, pycode)
+            return pycode
+        if self.parser is None:
+            self.parser = lampy.compiler.build_parser()
+        pycode, record = lampy.compiler.timing.compile_timed(self.parser,
+                                                             verb.body)
+        self.add_record(objid, verbid, verb, record, pycode)
+        if pycode is not None:
+            self.cache_put(verb.body, pycode)
+        return pycode
+
+    def add_record(self, objid, verbid, verb, record, pycode):
+        """Keep the report record of a verb, record None standing for a
+        compile cache hit."""
+        if record is None:
+            record = {'lex' : 0.0, 'parse' : 0.0, 'codegen' : 0.0,
+                      'tokens' : None, 'size' : len(pycode), 'error' : None,
+                      'line' : None, 'cached' : True}
+        else:
+            record['cached'] = False
+        record['object'] = objid
+        record['verb'] = verbid
+        record['name'] = verb.name
+        record['total'] = record['lex'] + record['parse'] + record['codegen']
+        self.records.append(record)
+
+    def convert_parallel(self, verbs, jobs):
+        """Convert with a pool of jobs worker processes, emitting the
+        results in database order."""
+        slots = threading.Semaphore(jobs * BatchesPerWorker)
+        stop = threading.Event()
+        pending = collections.deque()
+        failure = []
+        worker = convert_batch
+        if self.records is not None:
+            worker = profile_batch
+        pool = multiprocessing.Pool(jobs, init_worker)
+        try:
+            work = self.send_batches(verbs, slots, stop, pending, failure)
+            for results in pool.imap(worker, work):
+                batch, converted = pending.popleft()
+                for result in results:
+                    objid, verbid, pycode = result[:3]
+                    converted[(objid, verbid)] = pycode
+                    verb, body = batch[(objid, verbid)]
+                    if self.records is not None:
+                        self.add_record(objid, verbid, verb, result[3],
+                                        pycode)
+                    if pycode is not None:
+                        self.cache_put(body, pycode)
+                for objid, verbid, verb, body in batch.order:
+                    self.emit(objid, verbid, verb, converted[(objid, verbid)])
+                slots.release()
+        except:
+            # the feeder may be waiting for a slot; wake it to stop
+            stop.set()
+            slots.release()
+            pool.terminate()
+            pool.join()
+            raise
+        pool.close()
+        pool.join()
+        if failure:
+            raise failure[0][0], failure[0][1], failure[0][2]
+
+    def send_batches(self, verbs, slots, stop, pending, failure):
+        """Yield the cache misses of each batch of verbs as a slot frees
+        up, queueing the batch on pending."""
+        try:
+            while True:
+                slots.acquire()
+                if stop.is_set():
+                    return
+                batch = Batch(islice(verbs, BatchSize))
+                if not batch.order:
+                    return
+                converted = {}
+                misses = []
+                for objid, verbid, verb, body in batch.order:
+                    pycode = self.cache_get(body)
+                    if pycode is None:
+                        misses.append((objid, verbid, body))
+                        continue
+                    converted[(objid, verbid)] = pycode
+                    if self.records is not None:
+                        self.add_record(objid, verbid, verb, None, pycode)
+                pending.append((batch, converted))
+                yield misses
+        except:
+            # raised in the pool's feeder thread, this would hang it
+            failure.append(sys.exc_info())
+
+    def emit(self, objid, verbid, verb, pycode):
+        if pycode is None:
+            self.drop(objid, verbid)
+            return
+        if self.package is not None:
+            self.package.write_verb(objid, verbid, verb, pycode)
+            return
+        text = format_verb(verb, pycode)
+        if self.output is None:
+            sys.stdout.write(text)
+            return
+        fn = os.path.join(self.output, verb_filename(objid, verbid))
+        if not os.path.isdir(os.path.dirname(fn)):
+            os.makedirs(os.path.dirname(fn))
+        f = open(fn, 'w')
+        try:
+            f.write(text)
+        finally:
+            f.close()
+
+    def drop(self, objid, verbid):
+        """Leave out a verb that failed to convert.  Its file and
+        manifest entry go too, so the next run converts it again."""
+        if self.output is None:
+            return
+        self.manifest.pop('%d:%d' % (objid, verbid), None)
+        fn = os.path.join(self.output, verb_filename(objid, verbid))
+        if os.path.exists(fn):
+            os.remove(fn)
 
     def convert_verb_body(self, body):
-        parser = lampy.compiler.build_parser()
-        body = body.strip()
-        if body.endswith('.'):
-            body = body[:-1]
-        ast = parser.parse(body)
-        return ast.generate()
+        pycode = self.cache_get(body)
+        if pycode is not None:
+            return pycode
+        if self.parser is None:
+            self.parser = lampy.compiler.build_parser()
+        pycode = convert_verb_body(self.parser, body)
+        self.cache_put(body, pycode)
+        return pycode
+
+    def cache_get(self, body):
+        if self.compile_cache is None:
+            return None
+        return self.compile_cache.get(body)
+
+    def cache_put(self, body, pycode):
+        if self.compile_cache is not None:
+            self.compile_cache.put(body, pycode)
 
 def get_cli():
     parser = optparse.OptionParser()
     parser.add_option("-d", "--db", dest="dbfilename",
                       help="Moo databse file to convert")
+    parser.add_option("-c", "--cache", dest="cache", action="store_true",
+                      default=False,
+                      help="Load through (and keep) a binary snapshot of the db")
+    parser.add_option("-j", "--jobs", dest="jobs", type="int", default=1,
+                      help="Convert verbs in this many worker processes")
+    parser.add_option("--compile-cache", dest="compile_cache",
+                      help="Reuse generated code kept in this directory")
+    parser.add_option("--compile-cache-size", dest="compile_cache_size",
+                      type="int", default=256,
+                      help="Bound on the compile cache, in megabytes")
+    parser.add_option("-o", "--output", dest="output",
+                      help="Write one file per verb under this directory, "
+                           "only converting what changed since last time")
+    parser.add_option("-m", "--manifest", dest="manifest",
+                      help="Previous conversion manifest to compare against "
+                           "(default: the one in the output directory)")
+    parser.add_option("-p", "--package", dest="package",
+                      help="Write the objects as a Python package in this "
+                           "directory")
+    parser.add_option("-r", "--report", dest="report",
+                      help="Time each verb and go on past verbs that fail, "
+                           "writing a JSON report to this file")
     (options, args) = parser.parse_args()
     options = eval(str(options))  
+    if options['output'] and options['package']:
+        parser.error("--output and --package cannot be combined")
     return (options, args)
 
 if __name__ == '__main__':
     options, args = get_cli()
-    c = Converter(options['dbfilename'])
+    compile_cache = None
+    if options['compile_cache']:
+        compile_cache = lampy.compiler.cache.CompileCache(
+            options['compile_cache'], options['compile_cache_size'] << 20)
+    c = Converter(options['dbfilename'], cache=options['cache'],
+                  jobs=options['jobs'], compile_cache=compile_cache,
+                  output=options['output'], manifest=options['manifest'],
+                  package=options['package'], report=options['report'])
+    if options['output']:
+        print >> sys.stderr, 'conversion:', c.report()
+    if c.summary is not None:
+        print >> sys.stderr, 'report: %d verbs, %d failed, %.2fs compiling' \
+            % (c.summary['verbs'], c.summary['failed'],
+               c.summary['total']['seconds'])
+    if compile_cache is not None:
+        print >> sys.stderr, 'compile cache:', compile_cache.report()
 
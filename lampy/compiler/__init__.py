@@ -1,5 +1,7 @@
 import lexer
 import parser
 import ast
+import cache
+import timing
 
 build_parser = parser.build_parser
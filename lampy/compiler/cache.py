@@ -0,0 +1,142 @@
+import os
+import hashlib
+import lexer
+import parser
+import ast
+
+# default size bound of a cache, in bytes
+DefaultSize = 256 << 20
+
+# once over its bound, a cache is trimmed down to this share of it, so
+# eviction does not run again on the very next store
+LowWater = 0.8
+
+_version = None
+
+def compiler_version():
+    """A hash of the compiler's own source, so that any change to the
+    lexer, the grammar or the code generator invalidates every entry
+    cached by the previous compiler."""
+    global _version
+    if _version is None:
+        digest = hashlib.sha1()
+        for module in (lexer, parser, ast):
+            fn = os.path.splitext(module.__file__)[0] + '.py'
+            f = open(fn, 'rb')
+            try:
+                digest.update(f.read())
+            finally:
+                f.close()
+        _version = digest.hexdigest()
+    return _version
+
+def normalize_body(body):
+    """The verb program text the parser sees: no surrounding blank
+    space and no terminating '.' line."""
+    body = body.strip()
+    if body.endswith('.'):
+        body = body[:-1].rstrip()
+    return body
+
+class CompileCache(object):
+    """Generated Python for verb bodies, kept on disk under a directory
+    and addressed by a hash of the normalized body and the compiler
+    version, so equal bodies share an entry and a new compiler starts
+    from an empty cache.
+
+    Each entry is one file, <path>/ab/cdef..., holding the generated
+    code.  A hit touches the file's mtime; when the entries add up to
+    more than max_size bytes the least recently used are removed.
+    hits, misses, stores and evictions count what happened since the
+    cache was opened."""
+    def __init__(self, path, max_size=DefaultSize):
+        self.path = path
+        self.max_size = max_size
+        self.version = compiler_version()
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.size = sum([size for fn, mtime, size in self.entries()])
+
+    def key(self, body):
+        digest = hashlib.sha1(self.version)
+        digest.update('\0')
+        digest.update(normalize_body(body))
+        return digest.hexdigest()
+
+    def filename(self, key):
+        return os.path.join(self.path, key[:2], key[2:])
+
+    def get(self, body):
+        """The cached Python for body, or None."""
+        fn = self.filename(self.key(body))
+        try:
+            f = open(fn, 'rb')
+        except IOError:
+            self.misses += 1
+            return None
+        try:
+            pycode = f.read()
+        finally:
+            f.close()
+        try:
+            os.utime(fn, None)
+        except OSError:
+            pass
+        self.hits += 1
+        return pycode
+
+    def put(self, body, pycode):
+        fn = self.filename(self.key(body))
+        if not os.path.isdir(os.path.dirname(fn)):
+            os.makedirs(os.path.dirname(fn))
+        if os.path.exists(fn):
+            self.size -= os.path.getsize(fn)
+        # written aside and renamed, so a reader never sees half an
+        # entry
+        tmp = '%s.%d.tmp' % (fn, os.getpid())
+        f = open(tmp, 'wb')
+        try:
+            f.write(pycode)
+        finally:
+            f.close()
+        os.rename(tmp, fn)
+        self.stores += 1
+        self.size += len(pycode)
+        if self.size > self.max_size:
+            self.evict()
+
+    def entries(self):
+        """(filename, mtime, size) of every entry."""
+        for dirpath, dirnames, filenames in os.walk(self.path):
+            for name in filenames:
+                if name.endswith('.tmp'):
+                    continue
+                fn = os.path.join(dirpath, name)
+                st = os.stat(fn)
+                yield (fn, st.st_mtime, st.st_size)
+
+    def evict(self):
+        """Remove the least recently used entries until the cache is
+        down to LowWater of its bound."""
+        entries = sorted(self.entries(), key=lambda entry: entry[1])
+        self.size = sum([size for fn, mtime, size in entries])
+        for fn, mtime, size in entries:
+            if self.size <= self.max_size * LowWater:
+                break
+            os.remove(fn)
+            self.size -= size
+            self.evictions += 1
+
+    def report(self):
+        lookups = self.hits + self.misses
+        rate = 0.0
+        if lookups:
+            rate = 100.0 * self.hits / lookups
+        return ('%d hits, %d misses (%.1f%% hit rate), %d stored, '
+                '%d evicted, %d bytes cached' % (self.hits, self.misses, rate,
+                                                 self.stores, self.evictions,
+                                                 self.size))
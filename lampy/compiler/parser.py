@@ -421,6 +421,8 @@ def p_dollars_up(p):
 
 # Error rule for syntax errors
 def p_error(p):
+    if p is None:
+        raise SyntaxError, "Syntax error at end of input"
     msg = "Syntax error on line: " + str(p.lineno)
     raise SyntaxError, msg
 
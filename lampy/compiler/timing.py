@@ -0,0 +1,52 @@
+import time
+from itertools import chain, repeat
+import lexer
+import cache
+
+def compile_timed(parser, body):
+    """Convert the verb program body as parser.parse(body).generate()
+    does, timing its three stages apart: the lexer runs over the whole
+    body first and the parser is then fed the tokens.  Returns (pycode,
+    record); pycode is None when the body failed to convert, and the
+    record holds the seconds spent in lex, parse and codegen, the
+    number of tokens, the size of the output, and for a failure, the
+    error and the line it was found on."""
+    record = {'lex' : 0.0, 'parse' : 0.0, 'codegen' : 0.0, 'tokens' : 0,
+              'size' : 0, 'error' : None, 'line' : None}
+    body = cache.normalize_body(body)
+    lex = lexer.lexer
+    seen = []
+    def next_token(tokens):
+        token = tokens.next()
+        seen[:] = [token]
+        return token
+    stage = 'lex'
+    start = time.time()
+    try:
+        lex.lineno = 1
+        lex.input(body)
+        tokens = list(iter(lex.token, None))
+        record['tokens'] = len(tokens)
+        record['lex'] = time.time() - start
+        stage = 'parse'
+        start = time.time()
+        tokens = chain(tokens, repeat(None))
+        ast = parser.parse(None, lexer=lex,
+                           tokenfunc=lambda: next_token(tokens))
+        record['parse'] = time.time() - start
+        stage = 'codegen'
+        start = time.time()
+        pycode = ast.generate()
+        record['codegen'] = time.time() - start
+    except Exception, e:
+        record[stage] = time.time() - start
+        record['error'] = '%s: %s' % (e.__class__.__name__, e)
+        if stage == 'parse':
+            # the token the parser stopped at, or past the last line
+            if seen and seen[0] is not None:
+                record['line'] = seen[0].lineno
+            else:
+                record['line'] = body.count('\n') + 1
+        return (None, record)
+    record['size'] = len(pycode)
+    return (pycode, record)
@@ -1,2 +1,17 @@
 from wrappers import *
+import dbio
+import dbindex
+import snapshot
+import parallel
+import table
+import query
+import textindex
+import hierarchy
+import lookup
+import contents
+import properties
+import hashcons
 import db
+import dbwriter
+import checkpoint
+import sqlexport
@@ -0,0 +1,169 @@
+import os
+import re
+import cStringIO
+import dbio
+import dbwriter
+import db as moodb
+
+DeltaVersion = 1
+
+DeltaHeader = '** LambdaMOO Delta, Version %d **\n'
+
+delta_re = re.compile('\*\* LambdaMOO Delta, Version (\d+) \*\*')
+
+def delta_filename(fn):
+    return fn + '.delta'
+
+def encode_segment(db, dirty):
+    """One delta segment holding the current state of the objects in
+    dirty, in the database's own notation:
+
+        objectCount, then the player count and player numbers
+        count of recycled objects, then their numbers
+        count of object blocks, then the blocks
+        count of programs, then the programs
+
+    The segment starts with the signature of the database file it
+    applies to."""
+    out = cStringIO.StringIO()
+    writer = dbwriter.DatabaseWriter(out)
+    writer.write('%d %d %s\n' % dbio.file_signature(db.fn))
+    writer.write('%d\n%d\n' % (dbwriter.object_count(db),
+                                len(db.playerNumbers)))
+    for player in db.playerNumbers:
+        writer.write('%d\n' % player)
+    recycled = [objid for objid in sorted(dirty) if objid not in db.objects]
+    changed = [objid for objid in sorted(dirty) if objid in db.objects]
+    writer.write('%d\n' % len(recycled))
+    for objid in recycled:
+        writer.write('%d\n' % objid)
+    writer.write('%d\n' % len(changed))
+    programs = []
+    for objid in changed:
+        writer.write_object(db.objects[objid])
+        for verbid, verb in enumerate(db.objects[objid].verbs):
+            if verb._body is not None or verb.program is not None:
+                programs.append((objid, verbid, verb))
+    writer.write('%d\n' % len(programs))
+    writer.write_programs(programs)
+    writer.flush()
+    return out.getvalue()
+
+def write_delta(db, fn=None):
+    """Append a segment with every object marked dirty on db to its
+    delta file and clear the dirty set.  Returns the number of objects
+    written.  The segment goes out in a single write preceded by its
+    length, so a segment cut short by a crash is recognised and
+    skipped by read_deltas()."""
+    if fn is None:
+        fn = delta_filename(db.fn)
+    dirty = set(db.dirty)
+    if not dirty:
+        return 0
+    segment = encode_segment(db, dirty)
+    header = DeltaHeader % DeltaVersion + '%d\n' % len(segment)
+    size = 0
+    if os.path.exists(fn):
+        size = os.path.getsize(fn)
+    f = open(fn, 'ab')
+    try:
+        f.write(header + segment)
+        f.flush()
+        os.fsync(f.fileno())
+    finally:
+        f.close()
+    if db.delta_applied == size:
+        db.delta_applied = size + len(header) + len(segment)
+    else:
+        # db never read the segments before this one
+        db.delta_applied = None
+    db.dirty.difference_update(dirty)
+    return len(dirty)
+
+def apply_segment(db, delta):
+    """Read one segment from the LambdaMooDB delta, positioned just
+    after the segment length, into db."""
+    readline = delta.db.readline
+    signature = readline().split()
+    signature = (int(signature[0]), int(signature[1]), signature[2])
+    if signature != dbio.file_signature(db.fn):
+        raise ValueError, "%s does not apply to %s" % (delta.fn, db.fn)
+    db.objectCount = int(readline())
+    db.playerNumbers = [int(readline()) for _player in
+                        range(int(readline()))]
+    db.playerCount = len(db.playerNumbers)
+    for _objidx in range(int(readline())):
+        db.objects.pop(int(readline()), None)
+    for _objidx in range(int(readline())):
+        obj = delta.parse_object()
+        db.objects[obj.id] = obj
+    delta.verbCount = int(readline())
+    for objid, verbid, body in delta.read_verb_programs(delta.db):
+        db.objects[objid].get_verb(verbid).body = body
+
+def read_deltas(db, fn=None):
+    """Apply every complete segment of db's delta file to the parsed
+    db, in the order they were written.  Returns the number of
+    segments applied; db.delta_applied is set to the bytes of the
+    file they span.  The indexes built from db are dropped, since
+    objects were replaced; get_object() keeps reading the database
+    file itself and does not see the deltas."""
+    if fn is None:
+        fn = delta_filename(db.fn)
+    db.delta_applied = 0
+    if not os.path.exists(fn):
+        return 0
+    size = os.path.getsize(fn)
+    delta = moodb.LambdaMooDB(fn)
+    delta.pool = db.pool
+    segments = 0
+    try:
+        while True:
+            line = delta.db.readline()
+            if not line:
+                break
+            m = delta_re.match(line)
+            if not m or int(m.group(1)) != DeltaVersion:
+                raise ValueError, "Bad delta header: %s" % line
+            length = int(delta.db.readline())
+            start = delta.db.tell()
+            if start + length > size:
+                # the last segment was never completely written
+                break
+            apply_segment(db, delta)
+            if delta.db.tell() != start + length:
+                raise ValueError, "Corrupt delta segment at %d" % start
+            segments += 1
+            db.delta_applied = start + length
+    finally:
+        delta.db.close()
+    if segments:
+        db.table = db.hierarchy = db.lookup = None
+        db.contents_index = db.resolver = db.text_index = None
+    return segments
+
+def compact(db):
+    """Fold the deltas into the database: write db out over its own
+    file, point its verbs and tasks at their programs in the new file
+    and remove the delta file."""
+    writer = dbwriter.write_database(db, db.fn)
+    db.db.close()
+    db.db = dbio.open_reader(db.fn, db.reader)
+    for (objid, verbid), program in writer.programs.iteritems():
+        verb = db.objects[objid].get_verb(verbid)
+        verb.program = program
+        verb._body = None
+        verb._db = db
+    db.objectCount = dbwriter.object_count(db)
+    db.verbCount = len(writer.programs)
+    db.programs_offset = writer.programs_offset
+    db.tail_offset = writer.tail_offset
+    db.index = db.text_index = None
+    # task programs are located by their offsets in the tail, which
+    # has moved
+    db.parse_status_block()
+    db.dirty.clear()
+    db.delta_applied = 0
+    fn = delta_filename(db.fn)
+    if os.path.exists(fn):
+        os.remove(fn)
@@ -0,0 +1,81 @@
+class ContentsIndex(object):
+    """The contents of every location as a tuple, built once from the
+    contents_first_obj / location_contents_next_obj linked lists.
+
+    Lists keep the database's order; objects whose location_id names a
+    location but that its linked list missed are added at the end.
+    move() keeps the index, location_id and the linked list fields of
+    the two locations involved consistent."""
+    def __init__(self, objects):
+        self.objects = objects
+        self.locations = {}
+        self._contents = {}
+        by_location = {}
+        for objid in sorted(objects):
+            location = objects[objid].location_id
+            self.locations[objid] = location
+            if location in objects:
+                by_location.setdefault(location, []).append(objid)
+        for location, inside in by_location.iteritems():
+            self._contents[location] = self.walk_contents(location, inside)
+
+    def walk_contents(self, location, inside):
+        ordered = []
+        seen = set()
+        item = self.objects[location].contents_first_obj
+        while item in self.objects and item not in seen:
+            seen.add(item)
+            if self.objects[item].location_id == location:
+                ordered.append(item)
+            item = self.objects[item].location_contents_next_obj
+        ordered.extend([item for item in inside if item not in seen])
+        return tuple(ordered)
+
+    def contents(self, objid):
+        return self._contents.get(objid, ())
+
+    def location(self, objid):
+        return self.locations.get(objid, -1)
+
+    def enclosing(self, objid):
+        """The location of objid, its location, and so on outwards."""
+        chain = []
+        location = self.location(objid)
+        while location in self.objects and location not in chain:
+            chain.append(location)
+            location = self.location(location)
+        return tuple(chain)
+
+    def move(self, objid, location):
+        if location == objid or objid in self.enclosing(location):
+            raise ValueError, "#%d cannot be moved into #%d" % (objid,
+                                                                 location)
+        old = self.location(objid)
+        if old in self._contents:
+            self._contents[old] = tuple([item for item in self._contents[old]
+                                         if item != objid])
+        self.locations[objid] = location
+        self.objects[objid].location_id = location
+        self.objects[objid].location_contents_next_obj = -1
+        if location in self.objects:
+            self._contents[location] = self.contents(location) + (objid,)
+        self.relink(old)
+        self.relink(location)
+
+    def relink(self, location):
+        """Rewrite the contents linked list fields for location."""
+        if location not in self.objects:
+            return
+        inside = self.contents(location)
+        if inside:
+            self.objects[location].contents_first_obj = inside[0]
+        else:
+            self.objects[location].contents_first_obj = -1
+        for item, following in zip(inside, inside[1:] + (-1,)):
+            self.objects[item].location_contents_next_obj = following
+
+    def relink_all(self):
+        """Rewrite every contents linked list from the index, e.g. before
+        writing the database out."""
+        for location in self.objects:
+            self.relink(location)
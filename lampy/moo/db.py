@@ -1,5 +1,17 @@
 import re
 import sys
+import dbio
+import dbindex
+import snapshot
+import parallel
+import table
+import query
+import textindex
+import hierarchy
+import lookup
+import contents
+import properties
+from hashcons import ValuePool
 
 PlayerFlags = {
     1 : 'Player',
@@ -66,29 +78,135 @@ MooErrors = [
     'E_INVARG', 'E_QUOTA', 'E_FLOAT'
 ]
 
-class LambdaVerb(object):
-    def __init__(self, **kw):
-        self.__dict__.update(kw)
+TYPE_INT = 0
+TYPE_OBJ = 1
+TYPE_STR = 2
+TYPE_ERR = 3
+TYPE_LIST = 4
+TYPE_CLEAR = 5
+TYPE_NONE = 6
+TYPE_CATCH = 7
+TYPE_FINALLY = 8
+TYPE_FLOAT = 9
+
+class ObjRef(int):
+    """An object number value (TYPE_OBJ), as opposed to a plain int."""
+    __slots__ = ()
+
+    def __repr__(self):
+        return '#%d' % self
+
+class ErrCode(int):
+    """An error value (TYPE_ERR); its int value indexes MooErrors."""
+    __slots__ = ()
+
+    def __repr__(self):
+        if 0 <= self < len(MooErrors):
+            return MooErrors[self]
+        return 'ErrCode(%d)' % self
+
+class CatchMarker(int):
+    """A TYPE_CATCH marker, only found on suspended task stacks."""
+    __slots__ = ()
+
+class FinallyMarker(int):
+    """A TYPE_FINALLY marker, only found on suspended task stacks."""
+    __slots__ = ()
+
+class ClearValue(object):
+    """The value of a property slot that is "clear", meaning it takes
+    its value from the parent.  Clear is the only instance."""
+    __slots__ = ()
+
+    def __repr__(self):
+        return 'Clear'
+
+    def __nonzero__(self):
+        return False
+
+    def __reduce__(self):
+        return 'Clear'
+
+Clear = ClearValue()
+
+# value decoders by type code; each reads the lines after the type
+# code.  TYPE_LIST is handled by parse_variable() itself.
+VarDecoders = {
+    TYPE_INT : lambda readline: int(readline()),
+    TYPE_OBJ : lambda readline: ObjRef(readline()),
+    TYPE_STR : lambda readline: readline()[:-1],
+    TYPE_ERR : lambda readline: ErrCode(readline()),
+    TYPE_CLEAR : lambda readline: Clear,
+    TYPE_NONE : lambda readline: None,
+    TYPE_CATCH : lambda readline: CatchMarker(readline()),
+    TYPE_FINALLY : lambda readline: FinallyMarker(readline()),
+    TYPE_FLOAT : lambda readline: float(readline()),
+}
+
+class LambdaRecord(object):
+    """Base for the database record classes.  Each keeps a fixed set of
+    fields in __slots__ rather than a per-instance __dict__; fields that
+    are not given to the constructor start out as None."""
+    __slots__ = ()
 
-    def get_txt(self):
-        txt = ''
-        for key in self.__dict__:
-            txt += '" %s: %s\n' % (key, self.__dict__[key])
-        return txt
-            
-class LambdaProperty(object):
     def __init__(self, **kw):
-        self.__dict__.update(kw)
+        for key in self.__slots__:
+            setattr(self, key, None)
+        for key in kw:
+            setattr(self, key, kw[key])
+
+    def fields(self):
+        return [key for key in self.__slots__ if not key.startswith('_')]
+
+    # records are pickled as a tuple of their slots, which is smaller
+    # and quicker to load than the default; parse_parallel() sends
+    # them from its workers this way.  A verb's _db is left behind.
+    def __getstate__(self):
+        state = []
+        for key in self.__slots__:
+            if key == '_db':
+                state.append(None)
+            else:
+                state.append(getattr(self, key))
+        return tuple(state)
+
+    def __setstate__(self, state):
+        map(self.__setattr__, self.__slots__, state)
 
     def get_txt(self):
         txt = ''
-        for key in self.__dict__:
-            txt += '" %s: %s\n' % (key, self.__dict__[key])
+        for key in self.fields():
+            txt += '" %s: %s\n' % (key, getattr(self, key))
         return txt
 
-class LambdaObject(object):
-    def __init__(self, **kw):
-        self.__dict__.update(kw)
+class LambdaVerb(LambdaRecord):
+    __slots__ = ('name', 'owner_id', 'perms', 'preposition', 'program',
+                 '_body', '_db')
+
+    def get_body(self):
+        # verbs loaded by parse() only know where their program is;
+        # the text is read from the database file on each access
+        if self._body is not None:
+            return self._body
+        if self.program is not None:
+            return self._db.read_program(self.program)
+        raise AttributeError('body')
+
+    def set_body(self, body):
+        self._body = body
+
+    body = property(get_body, set_body)
+
+class LambdaProperty(LambdaRecord):
+    # name is None for the value slots of properties inherited from
+    # an ancestor
+    __slots__ = ('name', 'value', 'owner', 'perms')
+
+class LambdaObject(LambdaRecord):
+    __slots__ = ('id', 'name', 'flags', 'owner_id', 'location_id',
+                 'contents_first_obj', 'location_contents_next_obj',
+                 'parent_id', 'child_list_first_object',
+                 'parents_child_list_first_object', 'verbs', 'properties')
 
     def __cmp__(self, other):
         return cmp(self.id, other.id)
@@ -100,12 +218,15 @@ class LambdaObject(object):
 
     def write(self):
         f = open(str(self.id) + '.moo', 'w')
-        f.write(str(self.get_txt()))
+        try:
+            f.write(str(self.get_txt()))
+        finally:
+            f.close()
 
     def get_txt(self):
         txt = ''
-        for key in self.__dict__:
-            obj = self.__dict__[key]
+        for key in self.fields():
+            obj = getattr(self, key)
             if key == 'properties':
                 txt += '" %s:\n' % key
                 for prop in obj:
@@ -118,10 +239,53 @@ class LambdaObject(object):
                 txt += '" %s: %s\n' % (key, obj)
         return txt
 
+class LambdaActivation(LambdaRecord):
+    # one verb frame of a saved task.  program is the (offset, length)
+    # of the frame's source in the database file, variables is a list
+    # of (name, value) and stack the values on the frame's stack.
+    # bi_func_data holds the raw "bf_... data:" lines saved by the
+    # builtin the frame was in, if any.
+    __slots__ = ('language_version', 'program', 'variables', 'stack',
+                 'this', 'player', 'programmer', 'vloc', 'debug', 'verb',
+                 'verbname', 'temp', 'pc', 'bi_func_pc', 'error_pc',
+                 'bi_func', 'bi_func_data')
+
+class LambdaQueuedTask(LambdaRecord):
+    # a forked task waiting to start; activation only carries the
+    # this/player/programmer/verb fields
+    __slots__ = ('id', 'start_time', 'first_lineno', 'activation',
+                 'variables', 'program')
+
+class LambdaSuspendedTask(LambdaRecord):
+    # value is what suspend() will return, None when none was saved
+    __slots__ = ('id', 'start_time', 'value', 'top', 'vector', 'func_id',
+                 'max_stack', 'activations')
+
 class LambdaMooDB(object):
-    def __init__(self, fn):
+    def __init__(self, fn, reader='file', hashcons=False):
         self.fn = fn
-        self.db = open(fn)
+        self.reader = reader
+        self.db = dbio.open_reader(fn, reader)
+        self.programs_offset = None
+        self.tail_offset = None
+        self.clocks = []
+        self.queued_tasks = []
+        self.suspended_tasks = []
+        self.connections = []
+        self.index = None
+        self.table = None
+        self.hierarchy = None
+        self.lookup = None
+        self.contents_index = None
+        self.resolver = None
+        self.text_index = None
+        self.pool = None
+        self.dirty = set()
+        # bytes of the checkpoint delta reflected in objects, None when
+        # they match no prefix of the delta file
+        self.delta_applied = 0
+        if hashcons:
+            self.pool = ValuePool()
 
     def parse_debug(self):
         try:
@@ -130,45 +294,510 @@ class LambdaMooDB(object):
             print self.db.tell()
             raise
 
-    def parse(self):
+    def load(self):
+        """Populate the database from its snapshot when one matches the
+        file, otherwise parse() it and leave a snapshot for next time.
+        Checkpoint deltas written next to the file are applied on top."""
+        import checkpoint
+        if snapshot.load_snapshot(self):
+            self.parse_status_block()
+        else:
+            self.parse()
+            try:
+                snapshot.save_snapshot(self)
+            except IOError:
+                pass
+        checkpoint.read_deltas(self)
+
+    def mark_dirty(self, objid):
+        """Record that objid changed since the last checkpoint.  The
+        methods here that change objects do this themselves; code that
+        edits an object's fields, verbs or properties directly, or
+        recycles it by removing it from objects, has to call it."""
+        self.dirty.add(objid)
+
+    def checkpoint(self):
+        """Save the objects changed since the last checkpoint by
+        appending them to the delta file next to the database, leaving
+        the database itself untouched.  Returns the number of objects
+        saved."""
+        import checkpoint
+        return checkpoint.write_delta(self)
+
+    def compact(self):
+        """Rewrite the database file with every change folded in and
+        drop the delta file."""
+        import checkpoint
+        checkpoint.compact(self)
+
+    def parse(self, workers=1):
+        """Parse the whole database, with workers > 1 processes parsing
+        the object blocks."""
+        if workers > 1:
+            if self.pool is not None:
+                raise ValueError, "hashcons needs the serial parser"
+            parallel.parse_parallel(self, workers)
+            self.parse_status_block()
+            self.delta_applied = 0
+            return
+        self.delta_applied = 0
+        self.db.seek(0)
         self.parse_intro_block()
         self.parse_player_block()
         self.parse_object_blocks()
         self.parse_verbs()
-        #self.parse_status_block()
-        #self.write()
+        self.parse_status_block()
+        if self.pool is not None:
+            self.pool.clear()
 
-    def write(self):
-        for obj in self.objects.itervalues():
-            obj.write()
+    def iter_objects(self):
+        """Yield each object, verb bodies attached, without keeping the
+        rest of the database in memory.  The object section and the
+        program section are read side by side through two file handles,
+        which works because both are stored in object number order."""
+        self.db.seek(0)
+        self.parse_intro_block()
+        self.parse_player_block()
+        start = self.db.tell()
+        if self.programs_offset is None:
+            # skipped rather than parsed, just to find the programs
+            for _block in self.scan_object_blocks():
+                pass
+        programs = self.iter_verbs()
+        program = next(programs, None)
+        self.db.seek(start)
+        for obj in self.read_object_blocks():
+            while program is not None and program[0] <= obj.id:
+                if program[0] == obj.id:
+                    obj.get_verb(program[1]).body = program[2]
+                program = next(programs, None)
+            yield obj
+
+    def iter_verbs(self):
+        """Yield (objid, verbid, body) for every verb program, reading
+        from a private file handle."""
+        if self.programs_offset is None:
+            self.db.seek(0)
+            self.parse_intro_block()
+            self.parse_player_block()
+            for _block in self.scan_object_blocks():
+                pass
+        fh = self.db.clone()
+        try:
+            fh.seek(self.programs_offset)
+            for program in self.read_verb_programs(fh):
+                yield program
+        finally:
+            fh.close()
+
+    def get_table(self):
+        """Return the columnar ObjectTable of the parsed objects, built
+        on first use.  Callers that change an object's fields should
+        pass it to table.update()."""
+        if self.table is None:
+            self.table = table.ObjectTable(self.objects.itervalues(),
+                                           self.objectCount)
+        return self.table
+
+    def select(self, *predicates, **fields):
+        """Object numbers of the objects matching every predicate and
+        keyword, e.g.
+
+            from lampy.moo.query import *
+            db.select(flags & WIZARD, owner == 2,
+                      parent.isin(descendants(1)))
+            db.select(flags & PLAYER, location=3, parent=[4, 5])
+
+        The query is compiled to masks over get_table()."""
+        predicate = query.compile_query(predicates, fields)
+        table = self.get_table()
+        return table.select(predicate.mask(self, table))
+
+    def export_sqlite(self, fn):
+        """Export the database to a new SQLite file; see sqlexport."""
+        import sqlexport
+        sqlexport.export_sqlite(self, fn)
+
+    def get_hierarchy(self):
+        """Return the Hierarchy index of the parsed objects, built on
+        first use."""
+        if self.hierarchy is None:
+            self.hierarchy = hierarchy.Hierarchy(self.objects)
+        return self.hierarchy
+
+    def ancestors(self, objid):
+        return self.get_hierarchy().ancestors(objid)
+
+    def descendants(self, objid):
+        return self.get_hierarchy().descendants(objid)
+
+    def is_a(self, objid, parent):
+        return self.get_hierarchy().is_a(objid, parent)
+
+    def set_parent(self, objid, parent):
+        """Reparent objid, keeping the indexes and the child linked
+        list fields of the objects involved up to date.  The inherited
+        property slots of objid and its descendants are laid out again
+        for their new ancestors, as chparent() does; a property defined
+        both below objid and on the new ancestors is a ValueError."""
+        index = self.get_hierarchy()
+        resolver = self.get_property_resolver()
+        resolver.check_parent(objid, parent)
+        old = index.parents[objid]
+        moved = (objid,) + index.descendants(objid)
+        old_keys = [resolver.slot_keys(below) for below in moved]
+        index.set_parent(objid, parent)
+        if self.lookup is not None:
+            self.lookup.invalidate(objid)
+        resolver.invalidate(objid)
+        for below, keys in zip(moved, old_keys):
+            resolver.rebuild_slots(below, keys)
+        changed = [other for other in
+                   set([objid, old, parent] + list(moved)
+                       + index.children.get(old, [])
+                       + index.children.get(parent, []))
+                   if other in self.objects]
+        self.dirty.update(changed)
+        if self.table is not None:
+            for other in changed:
+                self.table.update(self.objects[other])
+
+    def get_contents_index(self):
+        """Return the ContentsIndex of the parsed objects, built on
+        first use."""
+        if self.contents_index is None:
+            self.contents_index = contents.ContentsIndex(self.objects)
+        return self.contents_index
+
+    def contents(self, objid):
+        return self.get_contents_index().contents(objid)
+
+    def move(self, objid, location):
+        """Move objid into location, keeping the contents index and the
+        contents linked list fields of both locations up to date."""
+        index = self.get_contents_index()
+        old = index.location(objid)
+        index.move(objid, location)
+        changed = [other for other in
+                   set((objid, old, location) + index.contents(old)
+                       + index.contents(location))
+                   if other in self.objects]
+        self.dirty.update(changed)
+        if self.table is not None:
+            for other in changed:
+                self.table.update(self.objects[other])
+
+    def get_property_resolver(self):
+        if self.resolver is None:
+            self.resolver = properties.PropertyResolver(self.objects,
+                                                        self.get_hierarchy())
+        return self.resolver
+
+    def get_property_value(self, objid, name):
+        """The value of property name on objid, resolving clear slots
+        through the parent chain.  Raises KeyError for unknown names."""
+        return self.get_property_resolver().get_value(objid, name)
+
+    def set_property_value(self, objid, name, value):
+        """Set property name on objid; pass Clear to clear it."""
+        self.get_property_resolver().set_value(objid, name, value)
+        self.dirty.add(objid)
+
+    def property_definer(self, objid, name):
+        return self.get_property_resolver().definer(objid, name)
+
+    def find_verb(self, objid, name, executable=False):
+        """Resolve name on objid following the MOO '*' abbreviation
+        rules and the parent chain.  Returns (definer, verb), or None
+        when no verb matches.  With executable set, verbs without the
+        x perm are passed over, the way obj:name() finds the verb to
+        call."""
+        if self.lookup is None:
+            self.lookup = lookup.VerbLookup(self.objects, self.get_hierarchy())
+        return self.lookup.find_verb(objid, name, executable)
+
+    def verbs_changed(self, objid):
+        """Tell the verb lookup cache and the checkpoint that objid's
+        verbs, or their bodies, changed."""
+        self.dirty.add(objid)
+        self.text_index = None
+        if self.lookup is not None:
+            self.lookup.invalidate(objid)
+
+    def get_text_index(self):
+        """Return the trigram index of the verb programs, reusing the
+        sidecar file next to the database when it is current.  A new
+        index is saved only while the objects match the file and the
+        delta applied to them, as the sidecar is keyed on those."""
+        current = not self.dirty and self.delta_applied is not None
+        if self.text_index is None and current:
+            self.text_index = textindex.load_text_index(self)
+        if self.text_index is None:
+            signature = textindex.text_index_signature(self)
+            self.text_index = textindex.VerbTextIndex.build(self, signature)
+            if current:
+                try:
+                    self.text_index.save(
+                        textindex.text_index_filename(self.fn))
+                except IOError:
+                    pass
+        return self.text_index
+
+    def search_verbs(self, text, regex=False, ignore_case=False):
+        """Find the verbs whose program contains text, or matches it as
+        a regular expression, and return them as '#obj:name' strings."""
+        index = self.get_text_index()
+        if regex:
+            flags = 0
+            if ignore_case:
+                flags = re.IGNORECASE
+            hits = index.search_regex(self, text, flags)
+        else:
+            hits = index.search(self, text, ignore_case)
+        return ['#%d:%s' % (objid, self.objects[objid].verbs[verbid].name)
+                for objid, verbid in hits]
+
+    def build_index(self):
+        """Scan the whole file and return a DatabaseIndex of it."""
+        index = dbindex.DatabaseIndex(dbio.file_signature(self.fn))
+        self.db.seek(0)
+        self.parse_intro_block()
+        self.parse_player_block()
+        for objid, offset in self.scan_object_blocks():
+            if objid is not None:
+                index.objects[objid] = offset
+        for objid, verbid, offset, length in self.scan_verb_programs(self.db):
+            index.programs[(objid, verbid)] = (offset, length)
+        return index
+
+    def get_index(self):
+        """Return the index of this database, reusing the sidecar file
+        next to it when it is current and writing a new one otherwise."""
+        if self.index is None:
+            self.index = dbindex.load_index(self.fn)
+        if self.index is None:
+            self.index = self.build_index()
+            try:
+                self.index.save(dbindex.index_filename(self.fn))
+            except IOError:
+                pass
+        return self.index
+
+    def get_object(self, objid):
+        """Parse and return only object #objid, seeking straight to its
+        block through the index.  Raises KeyError for object numbers
+        that are recycled or out of range."""
+        index = self.get_index()
+        self.db.seek(index.objects[objid])
+        obj = self.parse_object()
+        for verbid, verb in enumerate(obj.verbs):
+            program = index.programs.get((objid, verbid))
+            if program is not None:
+                verb.program = program
+                verb._db = self
+        return obj
+
+    def write(self, fn):
+        """Write the database out in Format Version 4.  See
+        dbwriter.write_database()."""
+        # dbwriter builds its encoder table from this module's types,
+        # so it cannot be imported while this module is
+        import dbwriter
+        dbwriter.write_database(self, fn)
 
     def parse_status_block(self):
-        self.status = {}
-        line_re = re.compile('(\d+) (\w+)')
-        for linecnt in range(4):
-            line = self.db.readline().strip()
-            print line
-            m = line_re.match(line)
-            if m:
-                self.status[m.group(0)] = int(m.group(1))
-        print self.status
+        """Parse the clocks, the queued and suspended tasks and the
+        active connections that follow the verb programs, in one pass.
+        Task values go through parse_variable(); task programs are
+        skipped and located by (offset, length) like verb programs.  A
+        file that ends after its programs has an empty tail, and
+        tail_offset is left None."""
+        self.clocks = []
+        self.queued_tasks = []
+        self.suspended_tasks = []
+        self.connections = []
+        if self.tail_offset is None:
+            return
+        self.db.seek(self.tail_offset)
+        readline = self.db.readline
+        if not readline():
+            self.tail_offset = None
+            return
+        self.db.seek(self.tail_offset)
+        self.clocks = [tuple(map(int, readline().split()))
+                       for _clock in range(self.parse_count('clocks'))]
+        self.queued_tasks = [self.parse_queued_task() for _task in
+                             range(self.parse_count('queued tasks'))]
+        self.suspended_tasks = [self.parse_suspended_task() for _task in
+                                range(self.parse_count('suspended tasks'))]
+        self.parse_connections()
+
+    def parse_count(self, what):
+        """Read a 'N what' line and return N."""
+        line = self.db.readline()
+        fields = line.split(None, 1)
+        if len(fields) != 2 or fields[1].rstrip('\n') != what:
+            raise ValueError, "Expected %s: %r" % (what, line)
+        return int(fields[0])
+
+    def parse_queued_task(self):
+        task = LambdaQueuedTask()
+        _dummy, task.first_lineno, task.start_time, task.id = \
+            map(int, self.db.readline().split())
+        task.activation = LambdaActivation()
+        self.parse_activation_info(task.activation)
+        task.variables = self.parse_variables()
+        task.program = self.skip_program(self.db)
+        return task
+
+    def parse_suspended_task(self):
+        task = LambdaSuspendedTask()
+        fields = self.db.readline().split(None, 2)
+        task.start_time, task.id = int(fields[0]), int(fields[1])
+        if len(fields) > 2:
+            # the value starts on the same line as the task header
+            first = [fields[2]]
+            readline = self.db.readline
+            task.value = self.parse_variable(
+                lambda: first and first.pop() or readline())
+        fields = map(int, self.db.readline().split())
+        task.top, task.vector, task.func_id = fields[:3]
+        if len(fields) > 3:
+            task.max_stack = fields[3]
+        task.activations = [self.parse_activation()
+                            for _activ in range(task.top + 1)]
+        return task
+
+    def parse_activation(self):
+        readline = self.db.readline
+        activ = LambdaActivation()
+        line = readline()
+        if not line.startswith('language version '):
+            raise ValueError, "Expected language version: %r" % line
+        activ.language_version = int(line.split()[2])
+        activ.program = self.skip_program(self.db)
+        activ.variables = self.parse_variables()
+        activ.stack = [self.parse_variable() for _slot in
+                       range(self.parse_count('rt_stack slots in use'))]
+        self.parse_activation_info(activ)
+        activ.temp = self.parse_variable()
+        fields = map(int, readline().split())
+        activ.pc, activ.bi_func_pc = fields[:2]
+        if len(fields) > 2:
+            activ.error_pc = fields[2]
+        else:
+            activ.error_pc = activ.pc
+        if activ.bi_func_pc:
+            activ.bi_func = readline()[:-1]
+            activ.bi_func_data = []
+            offset = self.db.tell()
+            line = readline()
+            while line.startswith('bf_') and ' data: ' in line:
+                activ.bi_func_data.append(line[:-1])
+                offset = self.db.tell()
+                line = readline()
+            self.db.seek(offset)
+        return activ
+
+    def parse_activation_info(self, activ):
+        """Read the frame fields written in the old parse info layout:
+        a placeholder value, a line of numbers, four retired strings,
+        then the verb and verb name."""
+        readline = self.db.readline
+        self.parse_variable()
+        fields = map(int, readline().split())
+        activ.this, activ.player = fields[0], fields[3]
+        activ.programmer, activ.vloc, activ.debug = fields[5], fields[6], \
+            fields[8]
+        for _line in range(4):
+            readline()
+        activ.verb = readline()[:-1]
+        activ.verbname = readline()[:-1]
+
+    def parse_variables(self):
+        readline = self.db.readline
+        variables = []
+        for _var in range(self.parse_count('variables')):
+            name = readline()[:-1]
+            variables.append((name, self.parse_variable()))
+        return variables
+
+    def parse_connections(self):
+        """Read the optional active connections section into a list of
+        (player, listener); listener is #0 in files without listeners."""
+        line = self.db.readline()
+        self.connections = []
+        if not line:
+            return
+        fields = line.split(None, 1) + ['']
+        what = fields[1].rstrip('\n')
+        if what == 'active connections with listeners':
+            for _conn in range(int(fields[0])):
+                who, listener = map(int, self.db.readline().split())
+                self.connections.append((who, listener))
+        elif what == 'active connections':
+            for _conn in range(int(fields[0])):
+                self.connections.append((int(self.db.readline()), 0))
+        else:
+            raise ValueError, "Expected active connections: %r" % line
     
     def parse_verbs(self):
+        self.attach_programs(self.scan_verb_programs(self.db))
+
+    def attach_programs(self, programs):
+        for objid, verbid, offset, length in programs:
+            verb = self.objects[objid].get_verb(verbid)
+            verb.program = (offset, length)
+            verb._db = self
+
+    def scan_verb_programs(self, fh):
+        """Yield (objid, verbid, offset, length) for every verb program,
+        where offset and length locate the program text in the file."""
         for _verbidx in range(self.verbCount):
-            verb = self.get_verb_by_name(self.db.readline())
+            objid, verbid = self.parse_verb_name(fh.readline())
+            try:
+                offset, length = self.skip_program(fh)
+            except ValueError:
+                raise ValueError, "Unterminated program #%d:%d" % \
+                    (objid, verbid)
+            yield (objid, verbid, offset, length)
+        self.tail_offset = fh.tell()
+
+    def skip_program(self, fh):
+        """Read past program text up to its '.' line and return its
+        (offset, length), the '.' line included."""
+        offset = fh.tell()
+        line = fh.readline()
+        while line.strip() != '.':
+            if not line:
+                raise ValueError, "Unterminated program at %d" % offset
+            line = fh.readline()
+        return (offset, fh.tell() - offset)
+
+    def read_program(self, program):
+        offset, length = program
+        return self.db.read_at(offset, length)
+
+    def read_verb_programs(self, fh):
+        for _verbidx in range(self.verbCount):
+            objid, verbid = self.parse_verb_name(fh.readline())
             body = ''
             nodot = True
             while nodot:
-                line = self.db.readline()
+                line = fh.readline()
                 body += line
                 if line.strip() == '.':
                     nodot = False
-            verb.body = body
+            yield (objid, verbid, body)
 
-    def get_verb_by_name(self, verbname):
+    def parse_verb_name(self, verbname):
         if verbname.startswith('#'):
             verbname = verbname[1:]
         objid, verbid = map(int, verbname.split(':'))
+        return (objid, verbid)
+
+    def get_verb_by_name(self, verbname):
+        objid, verbid = self.parse_verb_name(verbname)
         return self.objects[objid].get_verb(verbid)
 
     def parse_intro_block(self):
@@ -181,7 +810,7 @@ class LambdaMooDB(object):
             raise ValueError, "Bad header: %s" % line
         self.objectCount = int(self.db.readline())
         self.verbCount = int(self.db.readline())
-        self.db.readline() # dummyline
+        self.dummy = int(self.db.readline())
         self.playerCount = int(self.db.readline())
 
     def parse_player_block(self):
@@ -191,37 +820,86 @@ class LambdaMooDB(object):
 
     def parse_object_blocks(self):
         self.objects = {}
-        for _objidx in range(self.objectCount):
-            obj = LambdaObject()
-            # skip the '#'
-            objid = self.db.readline()[1:].strip()
-            if objid.endswith(' recycled'):
-                continue
-            obj.id = int(objid)
-            obj.name = self.db.readline().strip()
-            self.db.readline() # dummyline
-            obj.flags = int(self.db.readline())
-            obj.owner_id = int(self.db.readline())
-            obj.location_id = int(self.db.readline())
-            obj.contents_first_obj = int(self.db.readline())
-            obj.location_contents_next_obj = int(self.db.readline())
-            obj.parent_id = int(self.db.readline())
-            obj.child_list_first_object = int(self.db.readline())
-            obj.parents_child_list_first_object = int(self.db.readline())
-            obj.verbs = self.parse_verb_definitions()
-            obj.properties = self.parse_property_definitions()
+        for obj in self.read_object_blocks():
             self.objects[obj.id] = obj
-            #obj.write()
+
+    def read_object_blocks(self):
+        for _objidx in range(self.objectCount):
+            obj = self.parse_object()
+            if obj is not None:
+                yield obj
+        self.programs_offset = self.db.tell()
+
+    def parse_object(self):
+        # skip the '#'
+        objid = self.db.readline()[1:].strip()
+        if objid.endswith(' recycled'):
+            return None
+        obj = LambdaObject()
+        obj.id = int(objid)
+        obj.name = self.db.readline()[:-1]
+        self.db.readline() # dummyline
+        obj.flags = int(self.db.readline())
+        obj.owner_id = int(self.db.readline())
+        obj.location_id = int(self.db.readline())
+        obj.contents_first_obj = int(self.db.readline())
+        obj.location_contents_next_obj = int(self.db.readline())
+        obj.parent_id = int(self.db.readline())
+        obj.child_list_first_object = int(self.db.readline())
+        obj.parents_child_list_first_object = int(self.db.readline())
+        obj.verbs = self.parse_verb_definitions()
+        obj.properties = self.parse_property_definitions()
+        return obj
+
+    def scan_object_blocks(self):
+        """Yield (objid, offset) for every object block, reading past
+        the block instead of parsing it.  objid is None for recycled
+        slots."""
+        for _objidx in range(self.objectCount):
+            offset = self.db.tell()
+            yield (self.skip_object(), offset)
+        self.programs_offset = self.db.tell()
+
+    def skip_object(self):
+        readline = self.db.readline
+        objid = readline()[1:].strip()
+        if objid.endswith(' recycled'):
+            return None
+        # name, dummyline and the eight object number fields
+        for _line in range(10):
+            readline()
+        for _line in range(4 * int(readline())):
+            readline()
+        for _line in range(int(readline())):
+            readline()
+        for _propidx in range(int(readline())):
+            self.skip_variable()
+            readline()
+            readline()
+        return int(objid)
+
+    def skip_variable(self):
+        readline = self.db.readline
+        pending = 1
+        while pending:
+            _typ = int(readline())
+            pending -= 1
+            if _typ == TYPE_LIST:
+                pending += int(readline())
+            elif _typ not in (TYPE_CLEAR, TYPE_NONE):
+                readline()
 
     def parse_verb_definitions(self):
         verbs = []
         verbCnt = int(self.db.readline())
         for _verbidx in range(verbCnt):
             verb = LambdaVerb()
-            verb.name = self.db.readline().strip()
+            verb.name = self.db.readline()[:-1]
+            if self.pool is not None:
+                verb.name = self.pool.share(verb.name)
             verb.owner_id = int(self.db.readline())
             verb.perms = int(self.db.readline())
-            self.preposition = int(self.db.readline())
+            verb.preposition = int(self.db.readline())
             verbs.append(verb)
         return verbs
 
@@ -230,7 +908,9 @@ class LambdaMooDB(object):
         propCnt = int(self.db.readline())
         for _propidx in range(propCnt):
             prop = LambdaProperty()
-            prop.name = self.db.readline().strip()
+            prop.name = self.db.readline()[:-1]
+            if self.pool is not None:
+                prop.name = self.pool.share(prop.name)
             props.append(prop)
         _propCnt = int(self.db.readline())
         for _propIdx in range(_propCnt):
@@ -244,20 +924,47 @@ class LambdaMooDB(object):
             prop.perms = int(self.db.readline())
         return props
 
-    def parse_variable(self):
-        _typ = int(self.db.readline())
-        if _typ == 0:
-            return int(self.db.readline())
-        if _typ in (1, 2, 3, 7, 8):
-            return self.db.readline().strip()
-        if _typ == 9:
-            return float(self.db.readline())
-        if _typ == 4:
-            _len = int(self.db.readline())
-            return [self.parse_variable() for x in range(_len)]
-        if _typ in (5, 6):
-            return None
-        return None
+    def parse_variable(self, readline=None):
+        """Decode one value, reading lines with readline, by default
+        the database's.  Lists are filled in through an explicit
+        stack of (list, values still to read) instead of recursion, so
+        nesting depth is not bounded by the interpreter's recursion
+        limit; every other type is decoded by VarDecoders.  With
+        hashcons on, each value is shared through the pool as soon as
+        it is complete."""
+        if readline is None:
+            readline = self.db.readline
+        decoders = VarDecoders
+        share = None
+        if self.pool is not None:
+            share = self.pool.share
+        root = []
+        target, remaining = root, 1
+        stack = []
+        while True:
+            while not remaining:
+                if not stack:
+                    return root[0]
+                value = target
+                target, remaining = stack.pop()
+                if share is not None:
+                    target[-1] = share(value)
+            _typ = int(readline())
+            remaining -= 1
+            if _typ == TYPE_LIST:
+                value = []
+                target.append(value)
+                stack.append((target, remaining))
+                target, remaining = value, int(readline())
+                continue
+            try:
+                decode = decoders[_typ]
+            except KeyError:
+                raise ValueError, "Unknown var type: %d" % _typ
+            value = decode(readline)
+            if share is not None:
+                value = share(value)
+            target.append(value)
 
 if __name__ == '__main__':
     db = LambdaMooDB(sys.argv[1])
@@ -0,0 +1,47 @@
+import marshal
+import dbio
+
+IndexVersion = 1
+
+def index_filename(fn):
+    return fn + '.idx'
+
+class DatabaseIndex(object):
+    """Where everything lives in a database file: the byte offset of
+    each object's #N block, and the (offset, length) of each verb
+    program keyed by (objid, verbid).  Saved next to the database and
+    only trusted while the database's file_signature() is unchanged."""
+    def __init__(self, signature, objects=None, programs=None):
+        self.signature = signature
+        self.objects = objects or {}
+        self.programs = programs or {}
+
+    def save(self, fn):
+        f = open(fn, 'wb')
+        try:
+            marshal.dump((IndexVersion, self.signature, self.objects,
+                          self.programs), f)
+        finally:
+            f.close()
+
+    def load(cls, fn):
+        f = open(fn, 'rb')
+        try:
+            version, signature, objects, programs = marshal.load(f)
+        finally:
+            f.close()
+        if version != IndexVersion:
+            raise ValueError, "Unsupported index version: %s" % version
+        return cls(signature, objects, programs)
+    load = classmethod(load)
+
+def load_index(fn):
+    """Return the saved index for database fn, or None when there is no
+    index or it was built from a different version of the file."""
+    try:
+        index = DatabaseIndex.load(index_filename(fn))
+    except (IOError, EOFError, ValueError, TypeError):
+        return None
+    if index.signature != dbio.file_signature(fn):
+        return None
+    return index
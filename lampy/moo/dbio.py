@@ -0,0 +1,78 @@
+import os
+import mmap
+import hashlib
+
+# bytes hashed from each end of the file by file_signature()
+SignatureSample = 65536
+
+class FileReader(object):
+    """Reads the database through an ordinary buffered file."""
+    def __init__(self, fn):
+        self.fn = fn
+        self.fh = open(fn)
+        self.readline = self.fh.readline
+        self.tell = self.fh.tell
+        self.seek = self.fh.seek
+
+    def read_at(self, offset, length):
+        pos = self.fh.tell()
+        self.fh.seek(offset)
+        data = self.fh.read(length)
+        self.fh.seek(pos)
+        return data
+
+    def clone(self):
+        return self.__class__(self.fn)
+
+    def close(self):
+        self.fh.close()
+
+class MappedReader(object):
+    """Reads the database through a read-only memory map.  Lines are
+    scanned by byte offset inside the map, so there is no read buffer
+    to refill and seek()/tell() are plain offset updates."""
+    def __init__(self, fn):
+        self.fn = fn
+        self.fh = open(fn, 'rb')
+        self.buf = mmap.mmap(self.fh.fileno(), 0, access=mmap.ACCESS_READ)
+        self.readline = self.buf.readline
+        self.tell = self.buf.tell
+        self.seek = self.buf.seek
+
+    def read_at(self, offset, length):
+        return self.buf[offset:offset + length]
+
+    def clone(self):
+        return self.__class__(self.fn)
+
+    def close(self):
+        self.buf.close()
+        self.fh.close()
+
+Readers = {
+    'file' : FileReader,
+    'mmap' : MappedReader,
+}
+
+def open_reader(fn, reader='file'):
+    try:
+        cls = Readers[reader]
+    except KeyError:
+        raise ValueError, "Unknown reader: %s" % reader
+    return cls(fn)
+
+def file_signature(fn):
+    """Cheap identity of a database file: its size, its mtime and a
+    hash of its first and last 64k.  Used to tell whether a cache built
+    from the file is still valid."""
+    st = os.stat(fn)
+    digest = hashlib.md5()
+    f = open(fn, 'rb')
+    try:
+        digest.update(f.read(SignatureSample))
+        if st.st_size > SignatureSample:
+            f.seek(max(SignatureSample, st.st_size - SignatureSample))
+            digest.update(f.read())
+    finally:
+        f.close()
+    return (st.st_size, int(st.st_mtime), digest.hexdigest())
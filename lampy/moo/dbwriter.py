@@ -0,0 +1,200 @@
+import os
+import db as moodb
+
+FormatVersion = 4
+
+# output gathered in memory before each write to the file
+BufferSize = 1 << 20
+
+# the tail a database without one gets: no clocks and no tasks
+EmptyTail = '0 clocks\n0 queued tasks\n0 suspended tasks\n'
+
+# value encoders by Python type, the reverse of db.VarDecoders; lists
+# and tuples are handled by encode_value() itself.  Floats are written
+# the way the server writes them.
+VarEncoders = {
+    int : lambda value: '%d\n%d\n' % (moodb.TYPE_INT, value),
+    long : lambda value: '%d\n%d\n' % (moodb.TYPE_INT, value),
+    moodb.ObjRef : lambda value: '%d\n%d\n' % (moodb.TYPE_OBJ, value),
+    str : lambda value: '%d\n%s\n' % (moodb.TYPE_STR, value),
+    moodb.ErrCode : lambda value: '%d\n%d\n' % (moodb.TYPE_ERR, value),
+    moodb.ClearValue : lambda value: '%d\n' % moodb.TYPE_CLEAR,
+    type(None) : lambda value: '%d\n' % moodb.TYPE_NONE,
+    moodb.CatchMarker : lambda value: '%d\n%d\n' % (moodb.TYPE_CATCH, value),
+    moodb.FinallyMarker : lambda value: '%d\n%d\n' % (moodb.TYPE_FINALLY,
+                                                     value),
+    float : lambda value: '%d\n%.19g\n' % (moodb.TYPE_FLOAT, value),
+}
+
+def encode_value(value, parts):
+    """Append the lines encoding value to the list parts.  Like
+    parse_variable(), nested lists are walked with an explicit stack
+    rather than by recursion."""
+    append = parts.append
+    encoders = VarEncoders
+    pending = [value]
+    while pending:
+        value = pending.pop()
+        typ = type(value)
+        if typ is list or typ is tuple:
+            append('%d\n%d\n' % (moodb.TYPE_LIST, len(value)))
+            pending.extend(reversed(value))
+            continue
+        try:
+            encode = encoders[typ]
+        except KeyError:
+            raise ValueError, "Cannot write value: %r" % (value,)
+        append(encode(value))
+
+def object_count(db):
+    """The number of object slots to write, counting objects created
+    past the end of the parsed database."""
+    if db.objects:
+        return max(db.objectCount, max(db.objects) + 1)
+    return db.objectCount
+
+def program_text(body):
+    """body as it is stored in the program section, ending with its
+    '.' line; bodies read from a database already do."""
+    if not body.endswith('\n'):
+        body += '\n'
+    if body.rstrip('\n').rsplit('\n', 1)[-1].strip() != '.':
+        body += '.\n'
+    return body
+
+class DatabaseWriter(object):
+    """Streams a database to fh in Format Version 4.  Output is
+    collected in a list of strings and handed to the file in pieces of
+    about bufsize bytes, so the file sees a few large writes rather
+    than one per line.
+
+    The writer counts what it writes, so afterwards programs maps each
+    (objid, verbid) to the (offset, length) of its program text, and
+    programs_offset and tail_offset locate those sections, the same as
+    parsing the new file would give."""
+    def __init__(self, fh, bufsize=BufferSize):
+        self.fh = fh
+        self.bufsize = bufsize
+        self.chunks = []
+        self.size = 0
+        self.offset = 0
+        self.programs = {}
+        self.programs_offset = None
+        self.tail_offset = None
+
+    def write(self, data):
+        self.chunks.append(data)
+        self.size += len(data)
+        self.offset += len(data)
+        if self.size >= self.bufsize:
+            self.flush()
+
+    def flush(self):
+        self.fh.write(''.join(self.chunks))
+        self.chunks = []
+        self.size = 0
+
+    def write_header(self, db, objectCount, programCount):
+        self.write('** LambdaMOO Database, Format Version %d **\n'
+                   % FormatVersion)
+        self.write('%d\n%d\n%d\n%d\n' % (objectCount, programCount,
+                                         getattr(db, 'dummy', 0),
+                                         len(db.playerNumbers)))
+        for player in db.playerNumbers:
+            self.write('%d\n' % player)
+
+    def write_object(self, obj):
+        # the block is put together in one list and passed on in one
+        # piece; a call per line would cost more than the formatting
+        parts = []
+        write = parts.append
+        write('#%d\n%s\n\n%d\n%d\n%d\n%d\n%d\n%d\n%d\n%d\n' % (
+            obj.id, obj.name, obj.flags, obj.owner_id, obj.location_id,
+            obj.contents_first_obj, obj.location_contents_next_obj, obj.parent_id,
+            obj.child_list_first_object, obj.parents_child_list_first_object))
+        write('%d\n' % len(obj.verbs))
+        for verb in obj.verbs:
+            write('%s\n%d\n%d\n%d\n' % (verb.name, verb.owner_id, verb.perms,
+                                        verb.preposition))
+        # the object's own definitions come first, then the value slots
+        # of everything it inherits
+        names = []
+        for prop in obj.properties:
+            if prop.name is None:
+                break
+            names.append(prop.name)
+        write('%d\n' % len(names))
+        for name in names:
+            write('%s\n' % name)
+        write('%d\n' % len(obj.properties))
+        for prop in obj.properties:
+            encode_value(prop.value, parts)
+            write('%d\n%d\n' % (prop.owner, prop.perms))
+        self.write(''.join(parts))
+
+    def write_programs(self, programs):
+        self.programs_offset = self.offset
+        for objid, verbid, verb in programs:
+            body = program_text(verb.body)
+            self.write('#%d:%d\n' % (objid, verbid))
+            self.programs[(objid, verbid)] = (self.offset, len(body))
+            self.write(body)
+
+    def write_tail(self, db):
+        """Copy the clocks, task and connection sections from the file
+        db was parsed from.  parse_status_block() reads them into db,
+        but they are written back as the bytes they were read from, so
+        tasks pass through as is."""
+        self.tail_offset = self.offset
+        if db.tail_offset is None:
+            self.write(EmptyTail)
+            return
+        self.flush()
+        f = open(db.fn, 'rb')
+        try:
+            f.seek(db.tail_offset)
+            data = f.read(self.bufsize)
+            while data:
+                self.fh.write(data)
+                self.offset += len(data)
+                data = f.read(self.bufsize)
+        finally:
+            f.close()
+
+    def write_database(self, db):
+        objectCount = object_count(db)
+        programs = []
+        for objid in sorted(db.objects):
+            for verbid, verb in enumerate(db.objects[objid].verbs):
+                if verb._body is not None or verb.program is not None:
+                    programs.append((objid, verbid, verb))
+        self.write_header(db, objectCount, len(programs))
+        for objid in range(objectCount):
+            obj = db.objects.get(objid)
+            if obj is None:
+                self.write('#%d recycled\n' % objid)
+            else:
+                self.write_object(obj)
+        self.write_programs(programs)
+        self.write_tail(db)
+        self.flush()
+
+def write_database(db, fn, bufsize=BufferSize):
+    """Write the parsed db to fn as a Format Version 4 database.  An
+    unchanged database comes out byte for byte as it was read.  The
+    output goes to a temporary file that replaces fn once it is
+    complete, so fn may be the file db was parsed from.  Returns the
+    DatabaseWriter used."""
+    tmp = fn + '.tmp'
+    f = open(tmp, 'wb')
+    writer = DatabaseWriter(f, bufsize)
+    try:
+        try:
+            writer.write_database(db)
+        finally:
+            f.close()
+    except:
+        os.remove(tmp)
+        raise
+    os.rename(tmp, fn)
+    return writer
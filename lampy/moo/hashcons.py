@@ -0,0 +1,47 @@
+import sys
+
+class ValuePool(object):
+    """Hash-conses values while a database loads, so equal strings,
+    numbers and lists share a single instance.  Lists are stored as
+    tuples: a value shared by thousands of properties must not be
+    changed in place, so replace it instead.
+
+    Keys carry the type as well as the value, which keeps ObjRef(5),
+    ErrCode(5) and 5 apart; floats are keyed on their repr(), which
+    keeps -0.0 and 0.0 apart.  A list is keyed on the ids of its items,
+    so the items must be shared before the list is, the way
+    parse_variable() completes values bottom up; building a key then
+    never walks further than one level."""
+    def __init__(self):
+        self.values = {}
+        self.hits = 0
+        self.saved = 0
+
+    def share(self, value):
+        typ = type(value)
+        if typ is list:
+            value = tuple(value)
+            key = (tuple, tuple(map(id, value)))
+        elif typ is float:
+            # -0.0 == 0.0, but they must not be merged
+            key = (typ, repr(value))
+        else:
+            key = (typ, value)
+        shared = self.values.get(key)
+        if shared is None:
+            self.values[key] = value
+            return value
+        if shared is value:
+            return value
+        self.hits += 1
+        self.saved += sys.getsizeof(value)
+        return shared
+
+    def clear(self):
+        """Drop the pool itself once loading is done; the statistics
+        are kept."""
+        self.values = {}
+
+    def report(self):
+        return '%d duplicate values shared, %d bytes saved' % (self.hits,
+                                                               self.saved)
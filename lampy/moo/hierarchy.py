@@ -0,0 +1,114 @@
+class Hierarchy(object):
+    """Parent and children of every object, built once from the parsed
+    objects, with memoized ancestor and descendant queries.
+
+    Children are kept in the order of the database's child linked list
+    (child_list_first_object, then parents_child_list_first_object of
+    each child).  set_parent() updates the index, relinks those fields
+    on the objects involved and drops only the memos the move can have
+    changed."""
+    def __init__(self, objects):
+        self.objects = objects
+        self.parents = {}
+        self.children = {}
+        self._ancestors = {}
+        self._ancestor_sets = {}
+        self._descendants = {}
+        by_parent = {}
+        for objid in sorted(objects):
+            parent = objects[objid].parent_id
+            self.parents[objid] = parent
+            by_parent.setdefault(parent, []).append(objid)
+        for obj in objects.itervalues():
+            self.children[obj.id] = self.walk_children(obj,
+                                                       by_parent.get(obj.id, []))
+
+    def walk_children(self, obj, kids):
+        ordered = []
+        seen = set()
+        kid = obj.child_list_first_object
+        while kid in self.objects and kid not in seen:
+            seen.add(kid)
+            if self.objects[kid].parent_id == obj.id:
+                ordered.append(kid)
+            kid = self.objects[kid].parents_child_list_first_object
+        # children the linked list missed are still children
+        ordered.extend([kid for kid in kids if kid not in seen])
+        return ordered
+
+    def ancestors(self, objid):
+        """Parent, grandparent and so on up to the root, as a tuple."""
+        try:
+            return self._ancestors[objid]
+        except KeyError:
+            pass
+        chain = []
+        parent = self.parents.get(objid, -1)
+        while parent in self.parents and parent not in chain:
+            if parent in self._ancestors:
+                chain.append(parent)
+                chain.extend(self._ancestors[parent])
+                break
+            chain.append(parent)
+            parent = self.parents[parent]
+        result = self._ancestors[objid] = tuple(chain)
+        return result
+
+    def descendants(self, objid):
+        """Every object inheriting from objid, depth first, as a tuple."""
+        try:
+            return self._descendants[objid]
+        except KeyError:
+            pass
+        result = []
+        stack = list(reversed(self.children.get(objid, ())))
+        while stack:
+            kid = stack.pop()
+            result.append(kid)
+            stack.extend(reversed(self.children.get(kid, ())))
+        result = self._descendants[objid] = tuple(result)
+        return result
+
+    def is_a(self, objid, parent):
+        """True when objid is parent or inherits from it."""
+        if objid == parent:
+            return True
+        try:
+            ancestors = self._ancestor_sets[objid]
+        except KeyError:
+            ancestors = self._ancestor_sets[objid] = \
+                frozenset(self.ancestors(objid))
+        return parent in ancestors
+
+    def set_parent(self, objid, parent):
+        if parent == objid or parent in self.descendants(objid):
+            raise ValueError, "#%d cannot inherit from #%d" % (objid, parent)
+        old = self.parents[objid]
+        # objid and everything below it get new ancestors; the old and
+        # new ancestor chains get a different set of descendants
+        for moved in (objid,) + self.descendants(objid):
+            self._ancestors.pop(moved, None)
+            self._ancestor_sets.pop(moved, None)
+        for above in ((old,) + self.ancestors(old) +
+                      (parent,) + self.ancestors(parent)):
+            self._descendants.pop(above, None)
+        if old in self.children:
+            self.children[old].remove(objid)
+        self.parents[objid] = parent
+        if parent in self.children:
+            self.children[parent].append(objid)
+        self.objects[objid].parent_id = parent
+        self.relink(old)
+        self.relink(parent)
+
+    def relink(self, parent):
+        """Rewrite the child linked list fields of parent's children."""
+        if parent not in self.children:
+            return
+        kids = self.children[parent]
+        if kids:
+            self.objects[parent].child_list_first_object = kids[0]
+        else:
+            self.objects[parent].child_list_first_object = -1
+        for kid, sibling in zip(kids, kids[1:] + [-1]):
+            self.objects[kid].parents_child_list_first_object = sibling
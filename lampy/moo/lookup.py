@@ -0,0 +1,102 @@
+# verb perms bit of verbs that can be called as obj:name()
+EXECUTABLE = 4
+
+def compile_alias(alias):
+    """Turn one verb name alias into (required, rest, star, tail).
+
+    Following the server's verbcasecmp(), the letters before the first
+    '*' must all be typed, the letters after it may be abbreviated, and
+    a '*' at the very end accepts anything once the rest is typed:
+    'foo*bar' matches foo, foob, fooba and foobar; 'foo*' matches
+    anything starting with foo; '*' matches every name."""
+    alias = alias.lower()
+    star = alias.find('*')
+    if star < 0:
+        return (alias, '', False, False)
+    rest = alias[star + 1:]
+    tail = rest == '' or rest.endswith('*')
+    return (alias[:star], rest.replace('*', ''), True, tail)
+
+def alias_matches(compiled, word):
+    required, rest, star, tail = compiled
+    if not star:
+        return word == required
+    if not word.startswith(required):
+        return False
+    extra = word[len(required):]
+    return rest.startswith(extra) or (tail and extra.startswith(rest))
+
+class VerbTable(object):
+    """The verb names of one object, compiled: exact aliases in a dict
+    of the first verb index using them, wildcard aliases in verb order.
+    With executable set, verbs without the x perm are left out."""
+    def __init__(self, verbs, executable=False):
+        self.exact = {}
+        self.wild = []
+        for verbid, verb in enumerate(verbs):
+            if executable and not verb.perms & EXECUTABLE:
+                continue
+            for alias in (verb.name or '').split():
+                compiled = compile_alias(alias)
+                if compiled[2]:
+                    self.wild.append((verbid, compiled))
+                else:
+                    self.exact.setdefault(compiled[0], verbid)
+
+    def find(self, word):
+        """Index of the first verb with an alias matching word."""
+        found = self.exact.get(word)
+        for verbid, compiled in self.wild:
+            if found is not None and verbid >= found:
+                break
+            if alias_matches(compiled, word):
+                return verbid
+        return found
+
+class VerbLookup(object):
+    """Finds the verb a name resolves to on an object, searching the
+    object and then its ancestors, as obj:name() does when executable
+    is set.  Per-object name
+    tables are compiled on first use and results are cached per
+    (object, name).  Call invalidate() for an object whose verbs or
+    parent changed; that drops its cached results and those of
+    everything inheriting from it."""
+    def __init__(self, objects, hierarchy):
+        self.objects = objects
+        self.hierarchy = hierarchy
+        self.tables = {}
+        self.cache = {}
+
+    def get_table(self, objid, executable=False):
+        try:
+            return self.tables[(objid, executable)]
+        except KeyError:
+            table = self.tables[(objid, executable)] = \
+                VerbTable(self.objects[objid].verbs, executable)
+            return table
+
+    def find_verb(self, objid, name, executable=False):
+        """Return (definer, verb) for name on objid, or None.  With
+        executable set, only verbs with the x perm are found."""
+        word = name.lower()
+        results = self.cache.setdefault(objid, {})
+        try:
+            return results[(word, executable)]
+        except KeyError:
+            pass
+        result = None
+        for definer in (objid,) + self.hierarchy.ancestors(objid):
+            if definer not in self.objects:
+                continue
+            verbid = self.get_table(definer, executable).find(word)
+            if verbid is not None:
+                result = (definer, self.objects[definer].verbs[verbid])
+                break
+        results[(word, executable)] = result
+        return result
+
+    def invalidate(self, objid):
+        self.tables.pop((objid, False), None)
+        self.tables.pop((objid, True), None)
+        for below in (objid,) + self.hierarchy.descendants(objid):
+            self.cache.pop(below, None)
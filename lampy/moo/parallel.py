@@ -0,0 +1,160 @@
+import re
+import mmap
+import multiprocessing
+from itertools import izip
+import db as moodb
+
+# byte ranges of the object section handed out per worker, so one slow
+# range does not leave the rest of the pool idle
+ChunksPerWorker = 4
+
+block_re = re.compile(r'#(\d+)( recycled)?\n\Z')
+
+# the first line after the object section: the first verb program, or
+# the clocks when there are no programs
+section_end_re = re.compile(r'^(#\d+:\d+|\d+ clocks)$', re.M)
+
+def find_section_end(fn, start):
+    """Guess where the object section ends from the first line after
+    start that looks like what follows it.  A string value can look
+    like that too, so parse_parallel() checks the guess."""
+    f = open(fn, 'rb')
+    try:
+        if not f.read(1):
+            return start
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            m = section_end_re.search(buf, start)
+            if m is None:
+                return len(buf)
+            return m.start()
+        finally:
+            buf.close()
+    finally:
+        f.close()
+
+def find_block(fh, start, end):
+    """Offset of the first line at or after start, and before end, that
+    looks like the start of an object block, or None."""
+    if start > 0:
+        fh.seek(start - 1)
+        fh.readline()
+    else:
+        fh.seek(0)
+    offset = fh.tell()
+    while offset < end:
+        if block_re.match(fh.readline()):
+            return offset
+        offset = fh.tell()
+    return None
+
+def parse_blocks(db, offset, end, objectCount):
+    """Parse the object blocks from offset on, up to the first one
+    starting at or after end (any number, for end None) or the last
+    one of the section.  Returns (objects, stop, last), stop being the
+    offset after the last block parsed and last its number."""
+    fh = db.db
+    fh.seek(offset)
+    objects = []
+    last = None
+    while end is None or fh.tell() < end:
+        if last == objectCount - 1:
+            break
+        start = fh.tell()
+        last = int(block_re.match(fh.readline()).group(1))
+        fh.seek(start)
+        obj = db.parse_object()
+        if obj is not None:
+            objects.append(obj)
+    return (objects, fh.tell(), last)
+
+def parse_range(args):
+    """Worker side: parse the object blocks starting in the byte range
+    start to end, beginning at the first line there that looks like a
+    block header.  Returns (sync, stop, last, objects), sync being the
+    offset parsing began at, or a sync of None when no block could be
+    parsed from there."""
+    fn, reader, start, end, objectCount = args
+    db = moodb.LambdaMooDB(fn, reader)
+    try:
+        sync = find_block(db.db, start, end)
+        if sync is None:
+            return (None, None, None, [])
+        try:
+            objects, stop, last = parse_blocks(db, sync, end, objectCount)
+        except Exception:
+            # the line only looked like a block header; if it was one
+            # after all, parse_parallel() parses the range itself and
+            # meets the error there
+            return (None, None, None, [])
+        return (sync, stop, last, objects)
+    finally:
+        db.db.close()
+
+def scan_programs(args):
+    """Worker side: scan_verb_programs() from offset on; returns the
+    programs and the offset of the tail."""
+    fn, reader, offset, verbCount = args
+    db = moodb.LambdaMooDB(fn, reader)
+    try:
+        db.verbCount = verbCount
+        db.db.seek(offset)
+        return (list(db.scan_verb_programs(db.db)), db.tail_offset)
+    finally:
+        db.db.close()
+
+def split_ranges(start, end, count):
+    size = (end - start) // count + 1
+    return [(offset, min(offset + size, end))
+            for offset in range(start, end, size)]
+
+def parse_parallel(db, workers):
+    """Parse db with a pool of worker processes, one byte range of the
+    object section each, with the same result as the serial parse()."""
+    db.db.seek(0)
+    db.parse_intro_block()
+    db.parse_player_block()
+    start = db.db.tell()
+    end = start
+    if db.objectCount:
+        end = find_section_end(db.fn, start)
+    ranges = split_ranges(start, end, workers * ChunksPerWorker)
+    pool = multiprocessing.Pool(workers)
+    try:
+        scan = pool.apply_async(scan_programs, ((db.fn, db.reader, end,
+                                                 db.verbCount),))
+        results = pool.imap(parse_range, [(db.fn, db.reader, low, high,
+                                           db.objectCount)
+                                          for low, high in ranges])
+        db.objects = {}
+        position = start
+        last = None
+        for (low, high), result in izip(ranges, results):
+            if last == db.objectCount - 1 or position >= high:
+                continue
+            sync, stop, last_parsed, objects = result
+            # the worker may have synced on a line that only looks like
+            # a block header
+            if sync != position:
+                objects, stop, last_parsed = parse_blocks(db, position, high,
+                                                          db.objectCount)
+            for obj in objects:
+                db.objects[obj.id] = obj
+            position = stop
+            if last_parsed is not None:
+                last = last_parsed
+        if db.objectCount and last != db.objectCount - 1:
+            objects, position, last = parse_blocks(db, position, None,
+                                                   db.objectCount)
+            for obj in objects:
+                db.objects[obj.id] = obj
+        db.programs_offset = position
+        if position == end:
+            programs, db.tail_offset = scan.get()
+        else:
+            db.db.seek(position)
+            programs = list(db.scan_verb_programs(db.db))
+    finally:
+        pool.close()
+        pool.join()
+    db.attach_programs(programs)
@@ -0,0 +1,174 @@
+import db as moodb
+
+# property perms bit: inherited slots are owned by the inheriting
+# object's owner rather than the property's
+CHOWN = 4
+
+class PropertyResolver(object):
+    """Resolves property values by name, following clear slots up the
+    parent chain.
+
+    An object's property slots are its own definitions followed by
+    every slot of its parent, so slot layouts are shared down the
+    hierarchy and never copied.  Layouts, name lookups and resolved
+    values are memoized per object on first use; a resolved value is
+    the inherited instance itself, not a copy."""
+    def __init__(self, objects, hierarchy):
+        self.objects = objects
+        self.hierarchy = hierarchy
+        self._names = {}
+        self._slots = {}
+        self._values = {}
+
+    def own_count(self, objid):
+        count = 0
+        for prop in self.objects[objid].properties:
+            if prop.name is None:
+                break
+            count += 1
+        return count
+
+    def slot_names(self, objid):
+        """Names of objid's property slots, in slot order."""
+        try:
+            return self._names[objid]
+        except KeyError:
+            pass
+        names = []
+        for definer in (objid,) + self.hierarchy.ancestors(objid):
+            if definer in self._names:
+                names.extend(self._names[definer])
+                break
+            props = self.objects[definer].properties
+            names.extend([prop.name for prop in
+                          props[:self.own_count(definer)]])
+        names = self._names[objid] = tuple(names)
+        return names
+
+    def definitions(self, objid):
+        """(definer, property) for each of objid's slots, in slot order,
+        property being the definer's own slot; not memoized, so it also
+        serves while the hierarchy is being changed."""
+        defs = []
+        for definer in (objid,) + self.hierarchy.ancestors(objid):
+            props = self.objects[definer].properties
+            defs.extend([(definer, prop)
+                         for prop in props[:self.own_count(definer)]])
+        return defs
+
+    def slot_keys(self, objid):
+        """(definer, lowercased name) of each of objid's slots."""
+        return [(definer, prop.name.lower())
+                for definer, prop in self.definitions(objid)]
+
+    def check_parent(self, objid, parent):
+        """Raise ValueError when objid or one of its descendants defines
+        a property parent already has, as chparent() refuses to."""
+        if parent not in self.objects or self.hierarchy.is_a(parent, objid):
+            # cycles are Hierarchy.set_parent()'s to refuse
+            return
+        inherited = set([name.lower() for name in self.slot_names(parent)])
+        for below in (objid,) + self.hierarchy.descendants(objid):
+            props = self.objects[below].properties
+            for prop in props[:self.own_count(below)]:
+                if prop.name.lower() in inherited:
+                    raise ValueError, "#%d already has a property %s" % \
+                        (parent, prop.name)
+
+    def rebuild_slots(self, objid, old_keys):
+        """Lay out objid's inherited slots again for its current
+        ancestors, old_keys being its slot_keys() before its parent
+        changed, as chparent() does: properties it still inherits keep
+        their slots, those it no longer inherits are dropped and new
+        ones start out clear, with the definer's perms and owner."""
+        obj = self.objects[objid]
+        old = dict(zip(old_keys, obj.properties))
+        own = self.own_count(objid)
+        props = obj.properties[:own]
+        for definer, prop in self.definitions(objid)[own:]:
+            try:
+                props.append(old[(definer, prop.name.lower())])
+                continue
+            except KeyError:
+                pass
+            owner = prop.owner
+            if prop.perms & CHOWN:
+                owner = obj.owner_id
+            props.append(moodb.LambdaProperty(value=moodb.Clear, owner=owner,
+                                              perms=prop.perms))
+        obj.properties = props
+
+    def slot(self, objid, name):
+        """Slot number of property name on objid; KeyError if none."""
+        try:
+            slots = self._slots[objid]
+        except KeyError:
+            slots = {}
+            names = self.slot_names(objid)
+            for index in range(len(names) - 1, -1, -1):
+                slots[names[index].lower()] = index
+            self._slots[objid] = slots
+        return slots[name.lower()]
+
+    def definer(self, objid, name):
+        """The ancestor (or objid itself) that defines property name."""
+        slot = self.slot(objid, name)
+        for definer in (objid,) + self.hierarchy.ancestors(objid):
+            own = self.own_count(definer)
+            if slot < own:
+                return definer
+            slot -= own
+        raise KeyError, name
+
+    def get_property(self, objid, name):
+        """The LambdaProperty holding objid's own slot for name, with
+        its owner and perms; its value may be Clear."""
+        return self.objects[objid].properties[self.slot(objid, name)]
+
+    def get_value(self, objid, name):
+        """The value of name on objid, with clear slots resolved through
+        the parent chain."""
+        slot = self.slot(objid, name)
+        memo = self._values.setdefault(objid, {})
+        try:
+            return memo[slot]
+        except KeyError:
+            pass
+        # walk up while the slot is clear, then memoize the value for
+        # every object passed on the way
+        path = []
+        current = objid
+        while True:
+            path.append((current, slot))
+            value = self.objects[current].properties[slot].value
+            if value is not moodb.Clear:
+                break
+            parent = self.hierarchy.parents.get(current, -1)
+            own = self.own_count(current)
+            if parent not in self.objects or slot < own:
+                break
+            cached = self._values.get(parent, {}).get(slot - own)
+            if cached is not None:
+                value = cached
+                break
+            current, slot = parent, slot - own
+        for obj, obj_slot in path:
+            self._values.setdefault(obj, {})[obj_slot] = value
+        return value
+
+    def set_value(self, objid, name, value):
+        """Set objid's own slot for name; pass Clear to clear it."""
+        self.get_property(objid, name).value = value
+        self.invalidate_values(objid)
+
+    def invalidate_values(self, objid):
+        for below in (objid,) + self.hierarchy.descendants(objid):
+            self._values.pop(below, None)
+
+    def invalidate(self, objid):
+        """Forget everything memoized for objid and its descendants,
+        e.g. after its definitions or its parent changed."""
+        for below in (objid,) + self.hierarchy.descendants(objid):
+            self._names.pop(below, None)
+            self._slots.pop(below, None)
+            self._values.pop(below, None)
@@ -0,0 +1,146 @@
+# object flag bits, as named in db.PlayerFlags
+PLAYER = 1
+PROGRAMMER = 2
+WIZARD = 4
+READ = 16
+WRITE = 32
+FERTILE = 128
+
+class Predicate(object):
+    """A condition on objects that compiles to one ObjectTable mask.
+    Predicates combine with &, | and ~ into a single mask expression,
+    so a query costs a few column scans however many objects there
+    are."""
+    def __and__(self, other):
+        return And(self, other)
+
+    def __or__(self, other):
+        return Or(self, other)
+
+    def __invert__(self):
+        return Not(self)
+
+class And(Predicate):
+    def __init__(self, *predicates):
+        self.predicates = predicates
+
+    def mask(self, db, table):
+        return table.mask_and(*[predicate.mask(db, table)
+                                for predicate in self.predicates])
+
+class Or(Predicate):
+    def __init__(self, *predicates):
+        self.predicates = predicates
+
+    def mask(self, db, table):
+        return table.mask_or(*[predicate.mask(db, table)
+                               for predicate in self.predicates])
+
+class Not(Predicate):
+    def __init__(self, predicate):
+        self.predicate = predicate
+
+    def mask(self, db, table):
+        return table.mask_not(self.predicate.mask(db, table))
+
+class Equal(Predicate):
+    def __init__(self, column, value):
+        self.column = column
+        self.value = value
+
+    def mask(self, db, table):
+        return table.mask_equal(self.column, self.value)
+
+class In(Predicate):
+    def __init__(self, column, values):
+        self.column = column
+        self.values = values
+
+    def mask(self, db, table):
+        values = self.values
+        if isinstance(values, ObjectSet):
+            values = values.resolve(db)
+        return table.mask_in(self.column, values)
+
+class HasFlags(Predicate):
+    """True where every bit of flags is set."""
+    def __init__(self, flags):
+        self.flags = flags
+
+    def mask(self, db, table):
+        return table.mask_flags(self.flags)
+
+class ObjectSet(object):
+    """A set of object numbers worked out from the database when the
+    query runs, for use with Column.isin()."""
+    def __init__(self, method, objid, inclusive=False):
+        self.method = method
+        self.objid = objid
+        self.inclusive = inclusive
+
+    def resolve(self, db):
+        objids = getattr(db, self.method)(self.objid)
+        if self.inclusive:
+            objids = (self.objid,) + tuple(objids)
+        return objids
+
+def descendants(objid, inclusive=False):
+    return ObjectSet('descendants', objid, inclusive)
+
+def ancestors(objid, inclusive=False):
+    return ObjectSet('ancestors', objid, inclusive)
+
+def contents(objid):
+    return ObjectSet('contents', objid)
+
+class Column(object):
+    """One table column as the left hand side of a comparison:
+    column == value, column != value, column.isin(values), and for
+    flags, flags & bits."""
+    def __init__(self, name):
+        self.name = name
+
+    def __eq__(self, value):
+        return Equal(self.name, value)
+
+    def __ne__(self, value):
+        return Not(Equal(self.name, value))
+
+    def __and__(self, flags):
+        if self.name != 'flags':
+            raise TypeError, "& only applies to flags, not %s" % self.name
+        return HasFlags(flags)
+
+    def isin(self, values):
+        return In(self.name, values)
+
+flags = Column('flags')
+owner = Column('owner_id')
+location = Column('location_id')
+parent = Column('parent_id')
+
+# keyword arguments select() accepts, by the column they test
+Keywords = {
+    'owner' : owner,
+    'location' : location,
+    'parent' : parent,
+}
+
+def compile_query(predicates, fields):
+    """Turn select()'s arguments into one predicate.  A keyword value
+    that is an int tests equality; anything else, an ObjectSet or a
+    sequence of object numbers, tests membership."""
+    predicates = list(predicates)
+    for key in sorted(fields):
+        try:
+            column = Keywords[key]
+        except KeyError:
+            raise ValueError, "Unknown query field: %s" % key
+        value = fields[key]
+        if isinstance(value, (int, long)):
+            predicates.append(column == value)
+        else:
+            predicates.append(column.isin(value))
+    if not predicates:
+        raise ValueError, "Empty query"
+    return And(*predicates)
@@ -0,0 +1,119 @@
+import marshal
+import dbio
+import db as moodb
+
+SnapshotVersion = 4
+
+ObjectFields = (
+    'id', 'name', 'flags', 'owner_id', 'location_id', 'contents_first_obj',
+    'location_contents_next_obj', 'parent_id', 'child_list_first_object',
+    'parents_child_list_first_object',
+)
+
+def snapshot_filename(fn):
+    return fn + '.snap'
+
+# marshal only stores the exact builtin types, so typed values are saved
+# as (type code, int) tuples; lists, and the tuples hash-consing turns
+# them into, are saved as lists
+ValueCodes = {
+    moodb.ObjRef : moodb.TYPE_OBJ,
+    moodb.ErrCode : moodb.TYPE_ERR,
+    moodb.CatchMarker : moodb.TYPE_CATCH,
+    moodb.FinallyMarker : moodb.TYPE_FINALLY,
+}
+
+ValueTypes = dict([(code, typ) for typ, code in ValueCodes.items()])
+
+def encode_value(value):
+    typ = type(value)
+    if typ is list or typ is tuple:
+        return [encode_value(item) for item in value]
+    if typ in ValueCodes:
+        return (ValueCodes[typ], int(value))
+    if value is moodb.Clear:
+        return (moodb.TYPE_CLEAR,)
+    return value
+
+def decode_value(value):
+    typ = type(value)
+    if typ is list:
+        return [decode_value(item) for item in value]
+    if typ is tuple:
+        if value[0] == moodb.TYPE_CLEAR:
+            return moodb.Clear
+        return ValueTypes[value[0]](value[1])
+    return value
+
+def encode_verb(verb):
+    return (verb.name, verb.owner_id, verb.perms, verb.preposition,
+            verb.program)
+
+def encode_property(prop):
+    return (prop.name, encode_value(prop.value), prop.owner, prop.perms)
+
+def encode_object(obj):
+    fields = tuple([getattr(obj, name) for name in ObjectFields])
+    verbs = tuple([encode_verb(verb) for verb in obj.verbs])
+    props = tuple([encode_property(prop) for prop in obj.properties])
+    return (fields, verbs, props)
+
+def save_snapshot(db, fn=None):
+    """Write the parsed state of db to a marshal snapshot.  Verb bodies
+    are not stored; they stay on disk in the database and are located
+    by the program offsets saved with each verb."""
+    if fn is None:
+        fn = snapshot_filename(db.fn)
+    header = (db.version, db.objectCount, db.verbCount, db.dummy,
+              db.playerNumbers, db.programs_offset, db.tail_offset)
+    objects = [encode_object(db.objects[objid]) for objid in sorted(db.objects)]
+    f = open(fn, 'wb')
+    try:
+        marshal.dump((SnapshotVersion, dbio.file_signature(db.fn), header,
+                      objects), f)
+    finally:
+        f.close()
+
+def decode_object(db, state):
+    fields, verbs, props = state
+    obj = moodb.LambdaObject(**dict(zip(ObjectFields, fields)))
+    obj.verbs = []
+    for name, owner_id, perms, preposition, program in verbs:
+        verb = moodb.LambdaVerb(name=name, owner_id=owner_id, perms=perms,
+                                preposition=preposition, program=program)
+        if program is not None:
+            verb._db = db
+        obj.verbs.append(verb)
+    obj.properties = []
+    for name, value, owner, perms in props:
+        obj.properties.append(moodb.LambdaProperty(
+            name=name, value=decode_value(value), owner=owner, perms=perms))
+    return obj
+
+def load_snapshot(db, fn=None):
+    """Populate db from its snapshot with a single read and decode.
+    Returns False, leaving db untouched, when there is no snapshot or it
+    was taken from a different version of the database file."""
+    if fn is None:
+        fn = snapshot_filename(db.fn)
+    try:
+        f = open(fn, 'rb')
+    except IOError:
+        return False
+    try:
+        try:
+            version, signature, header, objects = marshal.loads(f.read())
+        except (EOFError, ValueError, TypeError):
+            return False
+    finally:
+        f.close()
+    if version != SnapshotVersion or signature != dbio.file_signature(db.fn):
+        return False
+    (db.version, db.objectCount, db.verbCount, db.dummy, db.playerNumbers,
+     db.programs_offset, db.tail_offset) = header
+    db.playerCount = len(db.playerNumbers)
+    db.objects = {}
+    for state in objects:
+        obj = decode_object(db, state)
+        db.objects[obj.id] = obj
+    return True
@@ -0,0 +1,184 @@
+import os
+import sqlite3
+import db as moodb
+
+# rows handed to each executemany()
+BatchSize = 10000
+
+Schema = (
+    """CREATE TABLE objects (
+        id INTEGER PRIMARY KEY, name TEXT, flags INTEGER, owner INTEGER,
+        location INTEGER, contents_first INTEGER, contents_next INTEGER,
+        parent INTEGER, child_first INTEGER, sibling INTEGER)""",
+    """CREATE TABLE verbs (
+        object INTEGER, verb INTEGER, name TEXT, owner INTEGER,
+        perms INTEGER, preposition INTEGER, body TEXT,
+        PRIMARY KEY (object, verb))""",
+    """CREATE TABLE properties (
+        object INTEGER, slot INTEGER, name TEXT, inherited INTEGER,
+        owner INTEGER, perms INTEGER, value INTEGER,
+        PRIMARY KEY (object, slot))""",
+    """CREATE TABLE "values" (
+        id INTEGER PRIMARY KEY, list INTEGER, position INTEGER,
+        type INTEGER, number INTEGER, text TEXT, real REAL)""",
+)
+
+# built once the rows are in, which is cheaper than keeping them up to
+# date row by row
+Indexes = (
+    'CREATE INDEX objects_owner ON objects (owner)',
+    'CREATE INDEX objects_parent ON objects (parent)',
+    'CREATE INDEX objects_location ON objects (location)',
+    'CREATE INDEX verbs_name ON verbs (name)',
+    'CREATE INDEX properties_name ON properties (name)',
+    'CREATE INDEX values_list ON "values" (list, position)',
+)
+
+# the type code and the column holding each kind of scalar value
+ValueColumns = {
+    int : (moodb.TYPE_INT, 'number'),
+    long : (moodb.TYPE_INT, 'number'),
+    moodb.ObjRef : (moodb.TYPE_OBJ, 'number'),
+    str : (moodb.TYPE_STR, 'text'),
+    moodb.ErrCode : (moodb.TYPE_ERR, 'number'),
+    moodb.ClearValue : (moodb.TYPE_CLEAR, None),
+    type(None) : (moodb.TYPE_NONE, None),
+    moodb.CatchMarker : (moodb.TYPE_CATCH, 'number'),
+    moodb.FinallyMarker : (moodb.TYPE_FINALLY, 'number'),
+    float : (moodb.TYPE_FLOAT, 'real'),
+}
+
+def text(value):
+    """MOO strings are bytes with no declared encoding; store them as
+    text that decodes back to the same bytes."""
+    if value is None:
+        return None
+    return value.decode('latin-1')
+
+def insert_statement(table, width):
+    return 'INSERT INTO %s VALUES (%s)' % (table, ', '.join('?' * width))
+
+def batches(rows, size=BatchSize):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+class SQLiteExporter(object):
+    """Writes a parsed database into the tables of Schema.  A value is
+    one row of "values"; the items of a list are rows pointing back at
+    it through list and position, so a property refers to its value by
+    id, whatever its shape.  Property rows carry the slot's name, also
+    for slots inherited from an ancestor."""
+    def __init__(self, db):
+        self.db = db
+        self.value_rows = []
+        self.next_value = 1
+
+    def object_rows(self):
+        for objid in sorted(self.db.objects):
+            obj = self.db.objects[objid]
+            yield (obj.id, text(obj.name), obj.flags, obj.owner_id,
+                   obj.location_id, obj.contents_first_obj,
+                   obj.location_contents_next_obj, obj.parent_id,
+                   obj.child_list_first_object,
+                   obj.parents_child_list_first_object)
+
+    def verb_rows(self):
+        for objid in sorted(self.db.objects):
+            for verbid, verb in enumerate(self.db.objects[objid].verbs):
+                body = None
+                if verb._body is not None or verb.program is not None:
+                    body = verb.body
+                yield (objid, verbid, text(verb.name), verb.owner_id,
+                       verb.perms, verb.preposition, text(body))
+
+    def property_rows(self):
+        """Property rows; the rows of their values collect in
+        value_rows on the way."""
+        resolver = self.db.get_property_resolver()
+        for objid in sorted(self.db.objects):
+            names = resolver.slot_names(objid)
+            for slot, prop in enumerate(self.db.objects[objid].properties):
+                name = prop.name
+                if name is None and slot < len(names):
+                    name = names[slot]
+                yield (objid, slot, text(name), int(prop.name is None),
+                       prop.owner, prop.perms, self.add_value(prop.value))
+
+    def add_value(self, value):
+        """Queue the rows of value and return the id of its top row.
+        Lists are walked with an explicit stack, as in parse_variable()."""
+        top = self.next_value
+        pending = [(value, None, None)]
+        while pending:
+            value, parent, position = pending.pop()
+            valueid = self.next_value
+            self.next_value += 1
+            typ = type(value)
+            if typ is list or typ is tuple:
+                self.value_rows.append((valueid, parent, position,
+                                        moodb.TYPE_LIST, len(value), None,
+                                        None))
+                for index in range(len(value) - 1, -1, -1):
+                    pending.append((value[index], valueid, index))
+                continue
+            try:
+                code, column = ValueColumns[typ]
+            except KeyError:
+                raise ValueError, "Cannot export value: %r" % (value,)
+            number = string = real = None
+            if column == 'number':
+                number = int(value)
+            elif column == 'text':
+                string = text(value)
+            elif column == 'real':
+                real = value
+            self.value_rows.append((valueid, parent, position, code, number,
+                                    string, real))
+        return top
+
+    def export(self, conn):
+        for statement in Schema:
+            conn.execute(statement)
+        for batch in batches(self.object_rows()):
+            conn.executemany(insert_statement('objects', 10), batch)
+        for batch in batches(self.verb_rows()):
+            conn.executemany(insert_statement('verbs', 7), batch)
+        # the values of each batch of properties go in right after it
+        for batch in batches(self.property_rows()):
+            conn.executemany(insert_statement('properties', 7), batch)
+            conn.executemany(insert_statement('"values"', 7),
+                             self.value_rows)
+            self.value_rows = []
+        for statement in Indexes:
+            conn.execute(statement)
+
+def export_sqlite(db, fn):
+    """Export the parsed db to a new SQLite database fn, schema, rows
+    and indexes in a single transaction.  The export goes to a
+    temporary file that replaces fn once it is complete, so the
+    journal is not needed."""
+    tmp = fn + '.tmp'
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    # transactions are managed here rather than by the sqlite3 module,
+    # which would commit before each CREATE
+    conn = sqlite3.connect(tmp, isolation_level=None)
+    try:
+        try:
+            conn.execute('PRAGMA journal_mode = OFF')
+            conn.execute('PRAGMA synchronous = OFF')
+            conn.execute('BEGIN')
+            SQLiteExporter(db).export(conn)
+            conn.execute('COMMIT')
+        finally:
+            conn.close()
+    except:
+        os.remove(tmp)
+        raise
+    os.rename(tmp, fn)
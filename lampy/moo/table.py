@@ -0,0 +1,108 @@
+import operator
+from array import array
+from itertools import compress, imap, repeat
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+Columns = (
+    'flags', 'owner_id', 'location_id', 'contents_first_obj',
+    'location_contents_next_obj', 'parent_id', 'child_list_first_object',
+    'parents_child_list_first_object',
+)
+
+class ObjectTable(object):
+    """The integer fields of every object as columns: one array('i') per
+    field, indexed by object number, and a valid mask that is 0 for
+    recycled slots.
+
+    Masks hold one boolean per object number.  With numpy installed
+    they are numpy arrays computed over zero-copy views of the columns;
+    without it they are itertools pipelines, which still scan the
+    columns without a Python-level loop but can only be consumed once.
+    Combine masks with mask_and()/mask_or()/mask_not() and turn them
+    into object numbers with select()."""
+    def __init__(self, objects, size):
+        self.size = size
+        self.valid = array('b', [0]) * size
+        for name in Columns:
+            setattr(self, name, array('i', [-1]) * size)
+        for obj in objects:
+            self.update(obj)
+
+    def update(self, obj):
+        """Refresh the row of obj after its fields have changed, growing
+        the columns for an object numbered past the end."""
+        if obj.id >= self.size:
+            grow = obj.id + 1 - self.size
+            self.valid.extend(array('b', [0]) * grow)
+            for name in Columns:
+                getattr(self, name).extend(array('i', [-1]) * grow)
+            self.size = obj.id + 1
+        self.valid[obj.id] = 1
+        for name in Columns:
+            getattr(self, name)[obj.id] = getattr(obj, name)
+
+    def remove(self, objid):
+        self.valid[objid] = 0
+
+    def vector(self, column):
+        """A numpy view sharing memory with the named column."""
+        col = getattr(self, column)
+        return numpy.frombuffer(col, dtype=numpy.dtype(col.typecode))
+
+    def mask_equal(self, column, value):
+        if numpy is not None:
+            return self.vector(column) == value
+        return imap(operator.eq, getattr(self, column), repeat(value))
+
+    def mask_in(self, column, values):
+        if numpy is not None:
+            return numpy.in1d(self.vector(column), list(values))
+        return imap(frozenset(values).__contains__, getattr(self, column))
+
+    def mask_flags(self, flags):
+        """True where every bit of flags is set."""
+        if numpy is not None:
+            return (self.vector('flags') & flags) == flags
+        return imap(operator.eq, imap(flags.__rand__, self.flags),
+                    repeat(flags))
+
+    def mask_and(self, *masks):
+        if numpy is not None:
+            return reduce(operator.and_, masks)
+        return reduce(lambda left, right: imap(operator.and_, left, right),
+                      masks)
+
+    def mask_or(self, *masks):
+        if numpy is not None:
+            return reduce(operator.or_, masks)
+        return reduce(lambda left, right: imap(operator.or_, left, right),
+                      masks)
+
+    def mask_not(self, mask):
+        if numpy is not None:
+            return ~mask
+        return imap(operator.not_, mask)
+
+    def select(self, mask):
+        """Object numbers of the valid objects where mask is true."""
+        if numpy is not None:
+            return numpy.flatnonzero(self.vector('valid').astype(bool)
+                                     & mask).tolist()
+        return list(compress(xrange(self.size),
+                             imap(operator.and_, self.valid, mask)))
+
+    def with_flags(self, flags):
+        return self.select(self.mask_flags(flags))
+
+    def owned_by(self, owner):
+        return self.select(self.mask_equal('owner_id', owner))
+
+    def children_of(self, parent):
+        return self.select(self.mask_equal('parent_id', parent))
+
+    def located_in(self, location):
+        return self.select(self.mask_equal('location_id', location))
@@ -0,0 +1,158 @@
+import re
+import marshal
+import sre_parse
+import sre_constants
+from array import array
+from itertools import imap
+import dbio
+
+TextIndexVersion = 1
+
+def text_index_filename(fn):
+    return fn + '.tri'
+
+def trigrams(text):
+    """The set of three character substrings of text, lowercased."""
+    text = text.lower()
+    return set(imap(text.__getslice__, xrange(len(text) - 2),
+                    xrange(3, len(text) + 1)))
+
+def required_literals(pattern, flags=0):
+    """Literal strings every match of the regular expression pattern
+    must contain, found in its top level sequence and in the groups and
+    at-least-once repeats under it.  Alternations, classes and optional
+    parts contribute nothing, so the result may be empty."""
+    runs = []
+    pending = [sre_parse.parse(pattern, flags)]
+    while pending:
+        run = []
+        for op, arg in pending.pop():
+            if op == sre_constants.LITERAL and arg < 256:
+                run.append(chr(arg))
+                continue
+            runs.append(''.join(run))
+            run = []
+            if op == sre_constants.SUBPATTERN:
+                pending.append(arg[-1])
+            elif op in (sre_constants.MAX_REPEAT,
+                        sre_constants.MIN_REPEAT) and arg[0] >= 1:
+                pending.append(arg[2])
+        runs.append(''.join(run))
+    return [run for run in runs if run]
+
+class VerbTextIndex(object):
+    """A trigram inverted index over verb program text.  verbs lists
+    (objid, verbid) for every verb with a program; postings maps
+    each lowercased trigram to an array('i') of positions in verbs, in
+    increasing order.  A query looks up the trigrams its text must
+    contain, intersects their postings and reads only the verbs left
+    to confirm the match.  Saved next to the database and only trusted
+    while the database and the delta applied to it are unchanged."""
+    def __init__(self, signature, verbs=None, postings=None):
+        self.signature = signature
+        self.verbs = verbs or []
+        self.postings = postings or {}
+
+    def build(cls, db, signature=None):
+        index = cls(signature)
+        postings = {}
+        for objid in sorted(db.objects):
+            for verbid, verb in enumerate(db.objects[objid].verbs):
+                if verb._body is None and verb.program is None:
+                    continue
+                doc = len(index.verbs)
+                index.verbs.append((objid, verbid))
+                for gram in trigrams(verb.body):
+                    try:
+                        postings[gram].append(doc)
+                    except KeyError:
+                        postings[gram] = array('i', [doc])
+        index.postings = postings
+        return index
+    build = classmethod(build)
+
+    def save(self, fn):
+        postings = dict([(gram, docs.tostring())
+                         for gram, docs in self.postings.iteritems()])
+        f = open(fn, 'wb')
+        try:
+            marshal.dump((TextIndexVersion, self.signature, self.verbs,
+                          postings), f)
+        finally:
+            f.close()
+
+    def load(cls, fn):
+        f = open(fn, 'rb')
+        try:
+            version, signature, verbs, postings = marshal.load(f)
+        finally:
+            f.close()
+        if version != TextIndexVersion:
+            raise ValueError, "Unsupported text index version: %s" % version
+        for gram, docs in postings.iteritems():
+            postings[gram] = array('i', docs)
+        return cls(signature, verbs, postings)
+    load = classmethod(load)
+
+    def candidates(self, literals):
+        """Positions of the verbs containing every trigram of every
+        string in literals; all verbs when there is no trigram."""
+        grams = set()
+        for literal in literals:
+            grams.update(trigrams(literal))
+        if not grams:
+            return range(len(self.verbs))
+        lists = []
+        for gram in grams:
+            docs = self.postings.get(gram)
+            if docs is None:
+                return []
+            lists.append(docs)
+        lists.sort(key=len)
+        found = set(lists[0])
+        for docs in lists[1:]:
+            found.intersection_update(docs)
+            if not found:
+                break
+        return sorted(found)
+
+    def search(self, db, text, ignore_case=False):
+        """(objid, verbid) of every verb whose program contains text."""
+        if ignore_case:
+            text = text.lower()
+        hits = []
+        for doc in self.candidates([text]):
+            objid, verbid = self.verbs[doc]
+            body = db.objects[objid].verbs[verbid].body
+            if ignore_case:
+                body = body.lower()
+            if text in body:
+                hits.append((objid, verbid))
+        return hits
+
+    def search_regex(self, db, pattern, flags=0):
+        """(objid, verbid) of every verb whose program matches the
+        regular expression pattern somewhere."""
+        regex = re.compile(pattern, flags)
+        hits = []
+        for doc in self.candidates(required_literals(pattern, flags)):
+            objid, verbid = self.verbs[doc]
+            if regex.search(db.objects[objid].verbs[verbid].body):
+                hits.append((objid, verbid))
+        return hits
+
+def text_index_signature(db):
+    """The database file's signature and how much of its checkpoint
+    delta, whose verbs replace those in the file, db has applied."""
+    return (dbio.file_signature(db.fn), db.delta_applied)
+
+def load_text_index(db):
+    """Return the saved text index of db, or None when there is none
+    or it was built from different contents."""
+    try:
+        index = VerbTextIndex.load(text_index_filename(db.fn))
+    except (IOError, EOFError, ValueError, TypeError):
+        return None
+    if index.signature != text_index_signature(db):
+        return None
+    return index
@@ -1,5 +1,12 @@
 import compilertests 
+import dbtests
+import convertdbtests
 compilersuite = compilertests.GetTestSuite()
+dbsuite = dbtests.GetTestSuite()
+convertdbsuite = convertdbtests.GetTestSuite()
 def run_all():
+    import sys
     import unittest
-    unittest.main(compilertests)
+    suite = unittest.TestSuite([compilersuite, dbsuite, convertdbsuite])
+    result = unittest.TextTestRunner().run(suite)
+    sys.exit(not result.wasSuccessful())
@@ -1,3 +1,6 @@
+import os
+import shutil
+import tempfile
 import unittest
 import inspect
 from .. import compiler
@@ -282,6 +285,79 @@ class ErrorHandling(LampyTestFixture):
         res = self.execute("{a,b,c,d,e,f,w,y,q,r} = {1,2,3,4,5,6,2,{2},8,9};\nx = a < b && c > d + e * f ? w in y | - q - r", debug=0)[2]
         self.assertEqual(res['x'], -17)
 
+class CompileCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def get_suite(cls):
+        return unittest.TestLoader().loadTestsFromTestCase(cls)
+    get_suite = classmethod(get_suite)
+
+    def testHitMiss(self):
+        cache = compiler.cache.CompileCache(self.tmpdir)
+        self.assertEqual(cache.get('return 1;\n.\n'), None)
+        cache.put('return 1;\n.\n', 'return moo.Int(1)')
+        self.assertEqual(cache.get('  return 1;\n.'), 'return moo.Int(1)')
+        self.assertEqual((cache.hits, cache.misses, cache.stores), (1, 1, 1))
+        cache = compiler.cache.CompileCache(self.tmpdir)
+        self.assertEqual(cache.size, len('return moo.Int(1)'))
+        self.assertEqual(cache.get('return 1;'), 'return moo.Int(1)')
+        self.assertEqual(cache.get('return 2;'), None)
+
+    def testVersion(self):
+        cache = compiler.cache.CompileCache(self.tmpdir)
+        key = cache.key('return 1;')
+        cache.version = 'another compiler'
+        self.assertNotEqual(cache.key('return 1;'), key)
+
+    def testEviction(self):
+        cache = compiler.cache.CompileCache(self.tmpdir, max_size=100)
+        for number in range(5):
+            body = 'return %d;' % number
+            cache.put(body, 'x' * 30)
+            # make the store order visible in the mtimes
+            os.utime(cache.filename(cache.key(body)), (number, number))
+        self.assert_(cache.size <= 100)
+        self.assert_(cache.evictions >= 2)
+        self.assertEqual(cache.get('return 0;'), None)
+        self.assertEqual(cache.get('return 4;'), 'x' * 30)
+
+class TimingTests(unittest.TestCase):
+    def setUp(self):
+        self.parser = compiler.build_parser()
+
+    def get_suite(cls):
+        return unittest.TestLoader().loadTestsFromTestCase(cls)
+    get_suite = classmethod(get_suite)
+
+    def testTimed(self):
+        body = 'x = 1;\nreturn x + 2;\n.\n'
+        pycode, record = compiler.timing.compile_timed(self.parser, body)
+        self.assertEqual(pycode, self.parser.parse(body[:-3]).generate())
+        self.assertEqual(record['size'], len(pycode))
+        self.assertEqual(record['tokens'], 9)
+        self.assertEqual(record['error'], None)
+        for stage in ('lex', 'parse', 'codegen'):
+            self.assert_(record[stage] >= 0)
+
+    def testFailure(self):
+        pycode, record = compiler.timing.compile_timed(self.parser,
+                                                       'x = 1;\nreturn x + ;\n')
+        self.assertEqual(pycode, None)
+        self.assertEqual(record['line'], 2)
+        self.assert_(record['error'].startswith('SyntaxError'))
+        # a body cut short fails on its last line, and the parser is
+        # still usable afterwards
+        pycode, record = compiler.timing.compile_timed(self.parser,
+                                                       'x = 1;\nif (x)\n')
+        self.assertEqual((pycode, record['line']), (None, 2))
+        self.assertEqual(compiler.timing.compile_timed(self.parser,
+                                                       'x = 1;')[0],
+                         'x = moo.Int(1)')
+
 def GetTestSuite():
     ts = []
     for obj in globals().values():
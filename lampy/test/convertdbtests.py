@@ -0,0 +1,185 @@
+import os
+import sys
+import json
+import shutil
+import tempfile
+import cStringIO
+import unittest
+from .. import moo
+from .. import compiler
+from dbtests import MINIDB
+
+class ConvertTestFixture(unittest.TestCase):
+    def setUp(self):
+        # convertdb is the script next to the lampy package, so it is
+        # only imported once the tests run
+        global convertdb
+        import convertdb
+        self.tmpdir = tempfile.mkdtemp()
+        self.fn = os.path.join(self.tmpdir, 'mini.db')
+        f = open(self.fn, 'w')
+        f.write(MINIDB)
+        f.close()
+        self.out = os.path.join(self.tmpdir, 'out')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def load(self):
+        db = moo.db.LambdaMooDB(self.fn)
+        db.parse()
+        return db
+
+    def read(self, *path):
+        f = open(os.path.join(*path))
+        try:
+            return f.read()
+        finally:
+            f.close()
+
+    def get_suite(cls):
+        return unittest.TestLoader().loadTestsFromTestCase(cls)
+    get_suite = classmethod(get_suite)
+
+
+class ManifestTests(ConvertTestFixture):
+    def convert(self):
+        return convertdb.Converter(self.fn, output=self.out).counts
+
+    def testIncremental(self):
+        self.assertEqual(self.convert(), {'added' : 3, 'changed' : 0,
+                                          'unchanged' : 0, 'deleted' : 0})
+        self.assertEqual(self.read(self.out, '0', '0.py'),
+                         "do_login_command []\n173 2\nreturn moo.Int(1)\n")
+        self.assertEqual(self.convert(), {'added' : 0, 'changed' : 0,
+                                          'unchanged' : 3, 'deleted' : 0})
+        db = self.load()
+        db.objects[3].verbs[0].body = 'return 3;\n.\n'
+        db.objects[1].verbs[0].name = 'ini*tialize caf\xe9'
+        del db.objects[0].verbs[:]
+        db.write(self.fn)
+        self.assertEqual(self.convert(), {'added' : 0, 'changed' : 2,
+                                          'unchanged' : 0, 'deleted' : 1})
+        self.failIf(os.path.exists(os.path.join(self.out, '0')))
+        self.assertEqual(self.read(self.out, '3', '0.py'),
+                         "l*ook []\n173 2\nreturn moo.Int(3)\n")
+        self.failIf(os.path.exists(os.path.join(self.out,
+                                                'manifest.json.tmp')))
+        self.assertEqual(self.convert(), {'added' : 0, 'changed' : 0,
+                                          'unchanged' : 2, 'deleted' : 0})
+
+    def testMissingFile(self):
+        self.convert()
+        os.remove(os.path.join(self.out, '3', '0.py'))
+        self.assertEqual(self.convert(), {'added' : 0, 'changed' : 1,
+                                          'unchanged' : 2, 'deleted' : 0})
+        self.assert_(os.path.exists(os.path.join(self.out, '3', '0.py')))
+
+
+class ParallelTests(ConvertTestFixture):
+    def setUp(self):
+        ConvertTestFixture.setUp(self)
+        # a batch per verb, so several are in flight at once
+        self.batch_size = convertdb.BatchSize
+        convertdb.BatchSize = 1
+
+    def tearDown(self):
+        convertdb.BatchSize = self.batch_size
+        ConvertTestFixture.tearDown(self)
+
+    def convert(self, **kw):
+        stdout = sys.stdout
+        sys.stdout = cStringIO.StringIO()
+        try:
+            convertdb.Converter(self.fn, **kw)
+            return sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+
+    def testSameOutput(self):
+        serial = self.convert()
+        self.assertEqual(serial.count('\n'), 10)
+        self.assertEqual(self.convert(jobs=2), serial)
+        self.assertEqual(self.convert(jobs=2, cache=True), serial)
+        cache = compiler.cache.CompileCache(
+            os.path.join(self.tmpdir, 'cache'))
+        self.assertEqual(self.convert(jobs=2, compile_cache=cache), serial)
+        self.assertEqual(self.convert(jobs=2, compile_cache=cache), serial)
+        self.assertEqual((cache.hits, cache.misses), (3, 3))
+
+    def testFailure(self):
+        db = self.load()
+        db.objects[1].verbs[0].body = 'return 1 +;\n.\n'
+        db.write(self.fn)
+        self.assertRaises(SyntaxError, self.convert, jobs=2)
+
+
+class PackageTests(ConvertTestFixture):
+    def tearDown(self):
+        for name in sys.modules.keys():
+            if name == 'convertedmini' or name.startswith('convertedmini.'):
+                del sys.modules[name]
+        sys.path.remove(self.tmpdir)
+        ConvertTestFixture.tearDown(self)
+
+    def testPackage(self):
+        sys.path.insert(0, self.tmpdir)
+        package = os.path.join(self.tmpdir, 'convertedmini')
+        convertdb.Converter(self.fn, package=package)
+        import convertedmini
+        self.assertEqual(sorted(convertedmini.Objects), [0, 1, 2, 3, 5])
+        room = convertedmini.get_object(3)
+        self.assertEqual((room.id, room.name, room.parent), (3, 'The Room', 1))
+        look, = room.verbs
+        self.assertEqual(look.names, ['l*ook'])
+        self.assertEqual((look.perms, look.owner), (173, 2))
+        self.assertEqual(convertedmini.get_object(5).verbs, [])
+        self.assertEqual(convertedmini.get_object(0).verbs[0](None),
+                         moo.Int(1))
+        db = self.load()
+        del db.objects[5]
+        db.write(self.fn)
+        convertdb.Converter(self.fn, package=package)
+        self.failIf(os.path.exists(os.path.join(package, 'o5.py')))
+        self.failIf(os.path.exists(os.path.join(package, 'o5.pyc')))
+        self.assert_(os.path.exists(os.path.join(package, 'o3.py')))
+
+
+class ReportTests(ConvertTestFixture):
+    def testFailure(self):
+        db = self.load()
+        db.objects[0].verbs[0].body = 'x = ;\n.\n'
+        db.objects[1].verbs[0].body = 'return 1;\nreturn 1 +;\n.\n'
+        db.write(self.fn)
+        report = os.path.join(self.tmpdir, 'report.json')
+        convertdb.Converter(self.fn, output=self.out, report=report)
+        f = open(report)
+        try:
+            report = json.load(f)
+        finally:
+            f.close()
+        summary = report['summary']
+        self.assertEqual((summary['verbs'], summary['failed']), (3, 2))
+        self.assertEqual([(failure['object'], failure['line'])
+                          for failure in report['failures']], [(0, 1), (1, 2)])
+        # sizes are those of the one verb that converted
+        size = report['verbs'][2]['size']
+        self.assert_(size > 0)
+        self.assertEqual(summary['size_percentiles'],
+                         {'p50' : size, 'p90' : size, 'p99' : size,
+                          'max' : size})
+        self.failIf(os.path.exists(os.path.join(self.out, '1', '0.py')))
+        self.assert_(os.path.exists(os.path.join(self.out, '3', '0.py')))
+
+
+def GetTestSuite():
+    ts = []
+    for obj in globals().values():
+        try:
+            ts.append(obj.get_suite())
+        except:
+            pass
+    return unittest.TestSuite(ts)
+
+if __name__ == '__main__':
+    unittest.main()
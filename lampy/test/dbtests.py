@@ -0,0 +1,1011 @@
+import os
+import cPickle
+import shutil
+import tempfile
+import unittest
+from .. import moo
+
+# A tiny but complete Format Version 4 database: a root class, the
+# system object, a wizard standing in a room, a thing in the same room
+# and one recycled slot.
+MINIDB = """** LambdaMOO Database, Format Version 4 **
+6
+3
+0
+1
+2
+#0
+System Object
+
+0
+2
+-1
+-1
+-1
+1
+-1
+2
+1
+do_login_command
+2
+173
+-1
+1
+maxint
+2
+0
+2147483647
+2
+1
+5
+2
+5
+#1
+Root Class
+
+0
+2
+-1
+-1
+-1
+-1
+0
+-1
+1
+ini*tialize
+2
+173
+-2
+1
+description
+1
+2
+
+2
+5
+#2
+Wizard
+
+7
+2
+3
+-1
+5
+1
+-1
+3
+0
+0
+1
+5
+2
+5
+#3
+The Room
+
+0
+2
+-1
+2
+-1
+1
+5
+-1
+1
+l*ook
+2
+173
+-1
+1
+exits
+2
+4
+3
+1
+5
+4
+2
+2
+north
+3
+3
+9
+1.5
+2
+5
+2
+A room.
+2
+5
+#4 recycled
+#5
+Thing
+
+0
+2
+3
+-1
+-1
+3
+-1
+-1
+0
+0
+2
+5
+2
+5
+2
+A thing.
+2
+5
+#0:0
+return 1;
+.
+#1:0
+this.description = "";
+.
+#3:0
+player:tell(this.description);
+return this.exits;
+.
+0 clocks
+0 queued tasks
+0 suspended tasks
+"""
+
+# The same database with a clock, a forked task, a task suspended
+# inside call_function(), and a connection, in place of the empty tail.
+TASKDB = MINIDB[:MINIDB.index('0 clocks')] + """1 clocks
+0 0 0
+1 queued tasks
+0 1 1000 42
+0
+-111
+3 -7 -8 2 -9 2 -1 -10 0
+No
+More
+Parse
+Infos
+look
+l*ook
+1 variables
+x
+0
+5
+return x;
+.
+1 suspended tasks
+2000 43 0
+7
+0 1 0 50
+language version 4
+call_function("suspend", 5);
+return 1;
+.
+2 variables
+NUMBER
+0
+0
+y
+4
+2
+2
+hello
+1
+3
+1 rt_stack slots in use
+0
+5
+0
+-111
+3 -7 -8 2 -9 2 -1 -10 1
+No
+More
+Parse
+Infos
+look
+look
+6
+12 3 12
+call_function
+bf_call_function data: fname = suspend
+1 active connections with listeners
+2 0
+"""
+
+class DBTestFixture(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.fn = os.path.join(self.tmpdir, 'mini.db')
+        f = open(self.fn, 'w')
+        f.write(MINIDB)
+        f.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def load(self, **kw):
+        db = moo.db.LambdaMooDB(self.fn, **kw)
+        db.parse()
+        return db
+
+    def assertSameObject(self, obj, expected):
+        self.assertEqual(sorted(obj.get_txt().split('\n')),
+                         sorted(expected.get_txt().split('\n')))
+        for verb, expverb in zip(obj.verbs, expected.verbs):
+            self.assertEqual(getattr(verb, 'body', None),
+                             getattr(expverb, 'body', None))
+
+    def get_suite(cls):
+        return unittest.TestLoader().loadTestsFromTestCase(cls)
+    get_suite = classmethod(get_suite)
+
+
+class ParseTests(DBTestFixture):
+    def testHeader(self):
+        db = self.load()
+        self.assertEqual(db.version, 4)
+        self.assertEqual(db.playerNumbers, [2])
+        self.assertEqual(sorted(db.objects), [0, 1, 2, 3, 5])
+
+    def testObject(self):
+        obj = self.load().objects[3]
+        self.assertEqual(obj.name, 'The Room')
+        self.assertEqual(obj.parent_id, 1)
+        self.assertEqual(obj.contents_first_obj, 2)
+        self.assertEqual(obj.verbs[0].name, 'l*ook')
+        self.assertEqual(obj.properties[0].name, 'exits')
+        self.assertEqual(obj.properties[1].name, None)
+        self.assertEqual(obj.verbs[0].preposition, -1)
+        self.assertEqual(obj.verbs[0].perms, 173)
+        self.failIf(hasattr(obj, '__dict__'))
+
+    def testValues(self):
+        db = self.load()
+        exits = db.objects[3].properties[0].value
+        self.assertEqual(exits, [5, ['north', 3], 1.5])
+        self.assert_(isinstance(exits[0], moo.db.ObjRef))
+        self.assert_(isinstance(exits[1][1], moo.db.ErrCode))
+        self.assertEqual(repr(exits[1][1]), 'E_PERM')
+        self.assert_(db.objects[2].properties[0].value is moo.db.Clear)
+        self.assertEqual(db.objects[0].properties[0].value, 2147483647)
+
+    def testDeepList(self):
+        depth = 5000
+        f = open(self.fn, 'w')
+        f.write('4\n1\n' * depth + '7\n12\n8\n')
+        f.close()
+        db = moo.db.LambdaMooDB(self.fn)
+        value = db.parse_variable()
+        for _level in range(depth):
+            self.assertEqual(len(value), 1)
+            value = value[0]
+        self.assert_(isinstance(value, moo.db.CatchMarker))
+        self.assertEqual(value, 12)
+        db.db.seek(0)
+        db.skip_variable()
+        self.assertEqual(db.db.readline(), '8\n')
+
+    def testUnknownType(self):
+        f = open(self.fn, 'w')
+        f.write('11\n0\n')
+        f.close()
+        db = moo.db.LambdaMooDB(self.fn)
+        self.assertRaises(ValueError, db.parse_variable)
+
+    def testVerbBodies(self):
+        db = self.load()
+        self.assertEqual(db.objects[0].verbs[0].body, 'return 1;\n.\n')
+
+    def testLazyBodies(self):
+        for reader in ('file', 'mmap'):
+            verb = self.load(reader=reader).objects[3].verbs[0]
+            offset, length = verb.program
+            self.assertEqual(MINIDB[offset:offset + length], verb.body)
+            verb.body = 'return 0;\n.\n'
+            self.assertEqual(verb.body, 'return 0;\n.\n')
+
+
+    def testParallel(self):
+        expected = self.load().objects
+        for reader in ('file', 'mmap'):
+            db = moo.db.LambdaMooDB(self.fn, reader)
+            db.parse(workers=2)
+            self.assertEqual(sorted(db.objects), sorted(expected))
+            for objid, obj in expected.items():
+                self.assertSameObject(db.objects[objid], obj)
+
+    def testParallelResync(self):
+        # string values that look like a block header and like the
+        # first program line, with ranges small enough to land on them
+        f = open(self.fn, 'w')
+        f.write(MINIDB.replace('A room.', '#5').replace('A thing.', '#0:0'))
+        f.close()
+        expected = self.load().objects
+        chunks = moo.parallel.ChunksPerWorker
+        try:
+            for count in (7, 13, 40):
+                moo.parallel.ChunksPerWorker = count
+                db = moo.db.LambdaMooDB(self.fn)
+                db.parse(workers=2)
+                self.assertEqual(sorted(db.objects), sorted(expected))
+                for objid, obj in expected.items():
+                    self.assertSameObject(db.objects[objid], obj)
+                self.assertEqual(db.get_property_value(3, 'description'),
+                                 '#5')
+                self.assertEqual(db.objects[3].verbs[0].body,
+                                 'player:tell(this.description);\n'
+                                 'return this.exits;\n.\n')
+        finally:
+            moo.parallel.ChunksPerWorker = chunks
+
+    def testPickle(self):
+        obj = self.load().objects[3]
+        copy = cPickle.loads(cPickle.dumps(obj, 2))
+        self.assertEqual(copy.get_txt(), obj.get_txt())
+        self.assertEqual(copy.verbs[0].program, obj.verbs[0].program)
+        self.assertEqual(copy.verbs[0]._db, None)
+
+    def testScanObjectBlocks(self):
+        db = moo.db.LambdaMooDB(self.fn)
+        db.parse_intro_block()
+        db.parse_player_block()
+        blocks = list(db.scan_object_blocks())
+        self.assertEqual([objid for objid, offset in blocks],
+                         [0, 1, 2, 3, None, 5])
+        for objid, offset in blocks:
+            self.assertEqual(MINIDB[offset], '#')
+        self.assert_(MINIDB[db.programs_offset:].startswith('#0:0\n'))
+
+
+class HashconsTests(DBTestFixture):
+    def testPool(self):
+        pool = moo.hashcons.ValuePool()
+        share = lambda items: pool.share(map(pool.share, items))
+        first = share(['north', moo.db.ObjRef(5)])
+        second = share(['north', moo.db.ObjRef(5)])
+        self.assertEqual(first, ('north', 5))
+        self.assert_(first is second)
+        self.failIf(share([5]) is share([moo.db.ObjRef(5)]))
+        self.assertEqual(pool.hits, 3)
+        self.assert_(pool.saved > 0)
+        self.assertEqual(repr(pool.share(0.0)), '0.0')
+        self.assertEqual(repr(pool.share(-0.0)), '-0.0')
+        self.assert_(pool.share(-0.0) is pool.share(-0.0))
+
+    def testParse(self):
+        db = self.load(hashcons=True)
+        self.assertEqual(db.objects[3].properties[0].value,
+                         (5, ('north', 3), 1.5))
+        self.assertEqual(db.pool.values, {})
+        self.assertRaises(ValueError, db.parse, 2)
+
+
+class HierarchyTests(DBTestFixture):
+    def testQueries(self):
+        db = self.load()
+        self.assertEqual(db.ancestors(5), (3, 1))
+        self.assertEqual(db.ancestors(1), ())
+        self.assertEqual(db.descendants(1), (0, 2, 3, 5))
+        self.assertEqual(db.descendants(3), (5,))
+        self.assert_(db.is_a(5, 1))
+        self.assert_(db.is_a(5, 5))
+        self.failIf(db.is_a(1, 5))
+        self.failIf(db.is_a(2, 3))
+
+    def testSetParent(self):
+        db = self.load()
+        db.get_table()
+        self.assert_(db.is_a(5, 3))
+        self.assertEqual(db.descendants(3), (5,))
+        db.set_parent(5, 2)
+        self.assertEqual(db.ancestors(5), (2, 1))
+        self.failIf(db.is_a(5, 3))
+        self.assert_(db.is_a(5, 2))
+        self.assertEqual(db.descendants(3), ())
+        self.assertEqual(db.descendants(1), (0, 2, 5, 3))
+        self.assertEqual(db.objects[5].parent_id, 2)
+        self.assertEqual(db.objects[3].child_list_first_object, -1)
+        self.assertEqual(db.objects[2].child_list_first_object, 5)
+        self.assertEqual(db.table.children_of(2), [5])
+        self.assertRaises(ValueError, db.set_parent, 1, 5)
+
+    def testSetParentProperties(self):
+        db = self.load()
+        db.set_parent(5, 2)
+        self.assertEqual(db.get_property_resolver().slot_names(5),
+                         ('description',))
+        self.assertEqual(len(db.objects[5].properties), 1)
+        self.assertEqual(db.get_property_value(5, 'description'), 'A thing.')
+        self.assertRaises(KeyError, db.get_property_value, 5, 'exits')
+        db.write(self.fn)
+        db = self.load()
+        self.assertEqual(db.get_property_value(5, 'description'), 'A thing.')
+        # back under #3, exits comes back clear, with #3's owner and perms
+        db.set_parent(5, 3)
+        self.assertEqual(db.objects[5].properties[0].value, moo.db.Clear)
+        self.assertEqual(db.objects[5].properties[0].owner, 2)
+        self.assertEqual(db.objects[5].properties[0].perms, 5)
+        self.assertEqual(db.get_property_value(5, 'exits'),
+                         [5, ['north', 3], 1.5])
+        self.assertEqual(db.get_property_value(5, 'description'), 'A thing.')
+
+    def testSetParentConflict(self):
+        db = self.load()
+        db.objects[2].properties.insert(0, moo.db.LambdaProperty(
+            name='Exits', value=0, owner=2, perms=5))
+        self.assertRaises(ValueError, db.set_parent, 2, 3)
+        self.assertEqual(db.ancestors(2), (1,))
+
+
+class ContentsTests(DBTestFixture):
+    def testContents(self):
+        db = self.load()
+        self.assertEqual(db.contents(3), (2, 5))
+        self.assertEqual(db.contents(2), ())
+        self.assertEqual(db.get_contents_index().enclosing(5), (3,))
+
+    def testMove(self):
+        db = self.load()
+        db.get_table()
+        db.move(2, 5)
+        self.assertEqual(db.contents(3), (5,))
+        self.assertEqual(db.contents(5), (2,))
+        self.assertEqual(db.objects[2].location_id, 5)
+        self.assertEqual(db.objects[3].contents_first_obj, 5)
+        self.assertEqual(db.objects[5].location_contents_next_obj, -1)
+        self.assertEqual(db.objects[5].contents_first_obj, 2)
+        self.assertEqual(db.table.located_in(5), [2])
+        self.assertRaises(ValueError, db.move, 3, 2)
+        db.move(2, -1)
+        self.assertEqual(db.contents(5), ())
+        self.assertEqual(db.objects[5].contents_first_obj, -1)
+
+
+class PropertyTests(DBTestFixture):
+    def testResolve(self):
+        db = self.load()
+        resolver = db.get_property_resolver()
+        self.assertEqual(resolver.slot_names(5), ('exits', 'description'))
+        self.assertEqual(resolver.slot_names(0), ('maxint', 'description'))
+        self.assertEqual(db.get_property_value(5, 'description'), 'A thing.')
+        self.assertEqual(db.get_property_value(2, 'Description'), '')
+        self.assertEqual(db.get_property_value(5, 'exits'),
+                         [5, ['north', 3], 1.5])
+        self.assert_(db.get_property_value(5, 'exits') is
+                     db.objects[3].properties[0].value)
+        self.assertEqual(db.property_definer(5, 'description'), 1)
+        self.assertEqual(db.property_definer(5, 'exits'), 3)
+        self.assertRaises(KeyError, db.get_property_value, 2, 'exits')
+
+    def testSetValue(self):
+        db = self.load()
+        self.assertEqual(db.get_property_value(5, 'exits')[0], 5)
+        db.set_property_value(3, 'exits', [])
+        self.assertEqual(db.get_property_value(5, 'exits'), [])
+        db.set_property_value(5, 'description', moo.db.Clear)
+        self.assertEqual(db.get_property_value(5, 'description'), 'A room.')
+        db.set_property_value(3, 'description', moo.db.Clear)
+        self.assertEqual(db.get_property_value(5, 'description'), '')
+
+
+class VerbLookupTests(DBTestFixture):
+    def testAliases(self):
+        compile_alias = moo.lookup.compile_alias
+        matches = lambda alias, word: \
+            moo.lookup.alias_matches(compile_alias(alias), word)
+        for word in ('foo', 'foob', 'foobar'):
+            self.assert_(matches('foo*bar', word))
+        for word in ('fo', 'foobarx', 'fooz'):
+            self.failIf(matches('foo*bar', word))
+        self.assert_(matches('foo*', 'foolish'))
+        self.failIf(matches('foo*', 'fo'))
+        self.assert_(matches('*', 'anything'))
+        self.assert_(matches('a*b*', 'abzz'))
+        self.failIf(matches('a*b*', 'azz'))
+        self.assert_(matches('Look', 'look'))
+        self.failIf(matches('look', 'loo'))
+
+    def testFindVerb(self):
+        db = self.load()
+        definer, verb = db.find_verb(5, 'LOOK')
+        self.assertEqual((definer, verb.name), (3, 'l*ook'))
+        self.assertEqual(db.find_verb(5, 'l')[0], 3)
+        self.assertEqual(db.find_verb(5, 'init')[0], 1)
+        self.assertEqual(db.find_verb(2, 'look'), None)
+        self.assertEqual(db.find_verb(0, 'do_login_command')[0], 0)
+        self.assertEqual(db.find_verb(1, 'do_login_command'), None)
+
+    def testExecutable(self):
+        db = self.load()
+        db.objects[1].verbs[0].name = 'ini*tialize l*ook'
+        db.verbs_changed(1)
+        self.assertEqual(db.find_verb(5, 'look', executable=True)[0], 3)
+        db.objects[3].verbs[0].perms &= ~moo.lookup.EXECUTABLE
+        db.verbs_changed(3)
+        self.assertEqual(db.find_verb(5, 'look')[0], 3)
+        self.assertEqual(db.find_verb(5, 'look', executable=True)[0], 1)
+
+    def testInvalidate(self):
+        db = self.load()
+        self.assertEqual(db.find_verb(5, 'look')[0], 3)
+        db.set_parent(5, 2)
+        self.assertEqual(db.find_verb(5, 'look'), None)
+        db.objects[1].verbs[0].name = 'ini*tialize l*ook'
+        self.assertEqual(db.find_verb(5, 'look'), None)
+        db.verbs_changed(1)
+        self.assertEqual(db.find_verb(5, 'look')[0], 1)
+
+
+class TableTests(DBTestFixture):
+    def testQueries(self):
+        table = self.load().get_table()
+        self.assertEqual(table.size, 6)
+        self.assertEqual(table.with_flags(4), [2])
+        self.assertEqual(table.owned_by(2), [0, 1, 2, 3, 5])
+        self.assertEqual(table.children_of(1), [0, 2, 3])
+        self.assertEqual(table.located_in(3), [2, 5])
+        self.assertEqual(table.select(table.mask_not(table.mask_flags(1))),
+                         [0, 1, 3, 5])
+        self.assertEqual(table.select(table.mask_or(
+            table.mask_equal('parent_id', 3),
+            table.mask_in('location_id', [-1]))), [0, 1, 3, 5])
+
+    def testUpdate(self):
+        db = self.load()
+        table = db.get_table()
+        obj = db.objects[5]
+        obj.parent_id = 1
+        table.update(obj)
+        self.assertEqual(table.children_of(1), [0, 2, 3, 5])
+        table.remove(0)
+        self.assertEqual(table.children_of(1), [2, 3, 5])
+
+    def testNewObject(self):
+        db = self.load()
+        table = db.get_table()
+        old = db.objects[5]
+        obj = moo.db.LambdaObject(**dict([(name, getattr(old, name))
+                                          for name in old.__slots__]))
+        obj.id = 7
+        obj.location_id = obj.location_contents_next_obj = -1
+        obj.verbs = []
+        db.objects[7] = obj
+        db.move(7, 3)
+        self.assertEqual(table.size, 8)
+        self.assertEqual(table.located_in(3), [2, 5, 7])
+        self.assertEqual(table.children_of(3), [5, 7])
+        self.assertEqual(table.owned_by(-1), [])
+
+
+class QueryTests(DBTestFixture):
+    def testSelect(self):
+        from lampy.moo.query import flags, owner, location, parent, \
+            descendants, contents, WIZARD, PLAYER
+        db = self.load()
+        self.assertEqual(db.select(flags & WIZARD), [2])
+        self.assertEqual(db.select(flags & (PLAYER | WIZARD), owner == 2), [2])
+        self.assertEqual(db.select(~(flags & PLAYER), location=3), [5])
+        self.assertEqual(db.select(parent.isin(descendants(1))), [5])
+        self.assertEqual(db.select(parent=descendants(1, inclusive=True)),
+                         [0, 2, 3, 5])
+        self.assertEqual(db.select((parent == 3) | (location == 3)), [2, 5])
+        self.assertEqual(db.select(owner != 2), [])
+        self.assertEqual(db.select(location.isin(contents(3))), [])
+        self.assertEqual(db.select(parent=[1], location=-1), [0, 3])
+        self.assertRaises(ValueError, db.select, colour=3)
+        self.assertRaises(ValueError, db.select)
+        self.assertRaises(TypeError, lambda: location & WIZARD)
+
+    def testAfterChange(self):
+        from lampy.moo.query import location
+        db = self.load()
+        db.get_table()
+        db.move(5, 2)
+        self.assertEqual(db.select(location == 2), [5])
+
+class TextIndexTests(DBTestFixture):
+    def testLiterals(self):
+        literals = moo.textindex.required_literals
+        self.assertEqual(literals('this\\.desc(ription)?'), ['this.desc'])
+        self.assertEqual(literals('player:(tell|notify)'), ['player:'])
+        self.assertEqual(literals('x(abc)+y'), ['x', 'y', 'abc'])
+        self.assertEqual(literals('.*'), [])
+
+    def testSearch(self):
+        db = self.load()
+        self.assertEqual(db.search_verbs('this.description'),
+                         ['#1:ini*tialize', '#3:l*ook'])
+        self.assertEqual(db.search_verbs('return'),
+                         ['#0:do_login_command', '#3:l*ook'])
+        self.assertEqual(db.search_verbs('RETURN 1'), [])
+        self.assertEqual(db.search_verbs('RETURN 1', ignore_case=True),
+                         ['#0:do_login_command'])
+        self.assertEqual(db.search_verbs('re'),
+                         ['#0:do_login_command', '#3:l*ook'])
+        self.assertEqual(db.search_verbs('no such text'), [])
+        self.assertEqual(db.search_verbs(r'this\.\w+ = ""', regex=True),
+                         ['#1:ini*tialize'])
+        self.assertEqual(db.search_verbs('PLAYER:TELL', regex=True,
+                                         ignore_case=True), ['#3:l*ook'])
+
+    def testSidecar(self):
+        fn = moo.textindex.text_index_filename(self.fn)
+        self.load().get_text_index()
+        self.assert_(os.path.exists(fn))
+        db = self.load()
+        index = moo.textindex.load_text_index(db)
+        self.assertEqual(len(index.verbs), 3)
+        self.assertEqual(db.search_verbs('tell'), ['#3:l*ook'])
+        db.objects[0].verbs[0].body = 'player:tell(1);\n.\n'
+        db.verbs_changed(0)
+        self.assertEqual(db.search_verbs('tell'),
+                         ['#0:do_login_command', '#3:l*ook'])
+        db.checkpoint()
+        self.assertEqual(moo.textindex.load_text_index(db), None)
+
+    def testSidecarDelta(self):
+        db = self.load()
+        del db.objects[0].verbs[:]
+        db.verbs_changed(0)
+        db.checkpoint()
+        self.assertEqual(self.load().search_verbs('return 1'),
+                         ['#0:do_login_command'])
+        db = moo.db.LambdaMooDB(self.fn)
+        db.load()
+        self.assertEqual(db.search_verbs('return 1'), [])
+        self.assertEqual(self.load().search_verbs('return 1'),
+                         ['#0:do_login_command'])
+
+class StreamingTests(DBTestFixture):
+    def testIterObjects(self):
+        expected = self.load().objects
+        db = moo.db.LambdaMooDB(self.fn)
+        seen = []
+        for obj in db.iter_objects():
+            seen.append(obj.id)
+            self.assertEqual(obj.name, expected[obj.id].name)
+            for verb, expverb in zip(obj.verbs, expected[obj.id].verbs):
+                self.assertEqual(verb.body, expverb.body)
+        self.assertEqual(seen, [0, 1, 2, 3, 5])
+        self.assertFalse(hasattr(db, 'objects'))
+
+    def testIterVerbs(self):
+        db = moo.db.LambdaMooDB(self.fn)
+        programs = list(db.iter_verbs())
+        self.assertEqual([p[:2] for p in programs], [(0, 0), (1, 0), (3, 0)])
+        self.assertEqual(programs[2][2],
+            'player:tell(this.description);\nreturn this.exits;\n.\n')
+
+class ReaderTests(DBTestFixture):
+    def testMappedReader(self):
+        plain = self.load()
+        mapped = self.load(reader='mmap')
+        self.assertEqual(sorted(plain.objects), sorted(mapped.objects))
+        for objid, obj in plain.objects.items():
+            self.assertSameObject(mapped.objects[objid], obj)
+
+    def testMappedStreaming(self):
+        db = moo.db.LambdaMooDB(self.fn, reader='mmap')
+        bodies = [v.body for obj in db.iter_objects() for v in obj.verbs]
+        self.assertEqual(len(bodies), 3)
+
+    def testUnknownReader(self):
+        self.assertRaises(ValueError, moo.db.LambdaMooDB, self.fn, 'tape')
+
+class IndexTests(DBTestFixture):
+    def testGetObject(self):
+        expected = self.load().objects
+        db = moo.db.LambdaMooDB(self.fn)
+        for objid in (5, 0, 3):
+            obj = db.get_object(objid)
+            self.assertSameObject(obj, expected[objid])
+        self.assertEqual(db.get_object(3).verbs[0].body,
+                         expected[3].verbs[0].body)
+        self.assertRaises(KeyError, db.get_object, 4)
+
+    def testSidecar(self):
+        moo.db.LambdaMooDB(self.fn).get_object(1)
+        idxfn = moo.dbindex.index_filename(self.fn)
+        self.assert_(os.path.exists(idxfn))
+        index = moo.dbindex.load_index(self.fn)
+        self.assertEqual(sorted(index.objects), [0, 1, 2, 3, 5])
+        self.assertEqual(len(index.programs), 3)
+        f = open(self.fn, 'a')
+        f.write('0 active connections\n')
+        f.close()
+        self.assertEqual(moo.dbindex.load_index(self.fn), None)
+
+class StatusTests(DBTestFixture):
+    def setUp(self):
+        DBTestFixture.setUp(self)
+        f = open(self.fn, 'w')
+        f.write(TASKDB)
+        f.close()
+
+    def testEmpty(self):
+        f = open(self.fn, 'w')
+        f.write(MINIDB)
+        f.close()
+        db = self.load()
+        self.assertEqual(db.clocks, [])
+        self.assertEqual(db.queued_tasks, [])
+        self.assertEqual(db.suspended_tasks, [])
+        self.assertEqual(db.connections, [])
+
+    def testNoTail(self):
+        f = open(self.fn, 'w')
+        f.write(MINIDB[:MINIDB.index('0 clocks')])
+        f.close()
+        db = self.load()
+        self.assertEqual(db.tail_offset, None)
+        self.assertEqual(db.clocks, [])
+        self.assertEqual(db.queued_tasks, [])
+        out = os.path.join(self.tmpdir, 'out.db')
+        db.write(out)
+        self.assertEqual(open(out).read(), MINIDB)
+
+    def testQueued(self):
+        db = self.load()
+        self.assertEqual(db.clocks, [(0, 0, 0)])
+        task, = db.queued_tasks
+        self.assertEqual((task.id, task.start_time, task.first_lineno),
+                         (42, 1000, 1))
+        self.assertEqual(task.activation.this, 3)
+        self.assertEqual(task.activation.player, 2)
+        self.assertEqual(task.activation.verbname, 'l*ook')
+        self.assertEqual(task.variables, [('x', 5)])
+        self.assertEqual(db.read_program(task.program), 'return x;\n.\n')
+
+    def testSuspended(self):
+        db = self.load()
+        task, = db.suspended_tasks
+        self.assertEqual((task.id, task.start_time, task.value), (43, 2000, 7))
+        self.assertEqual((task.top, task.vector, task.max_stack), (0, 1, 50))
+        activ, = task.activations
+        self.assertEqual(db.read_program(activ.program),
+                         'call_function("suspend", 5);\nreturn 1;\n.\n')
+        self.assertEqual(activ.variables, [('NUMBER', 0),
+                                           ('y', ['hello', 3])])
+        self.assert_(isinstance(activ.variables[1][1][1], moo.db.ObjRef))
+        self.assertEqual(activ.stack, [5])
+        self.assertEqual((activ.this, activ.debug, activ.temp), (3, 1, None))
+        self.assertEqual((activ.pc, activ.bi_func_pc, activ.error_pc),
+                         (12, 3, 12))
+        self.assertEqual(activ.bi_func, 'call_function')
+        self.assertEqual(activ.bi_func_data,
+                         ['bf_call_function data: fname = suspend'])
+        self.assertEqual(db.connections, [(2, 0)])
+
+    def testErrorPC(self):
+        f = open(self.fn, 'w')
+        f.write(TASKDB.replace('\n12 3 12\n', '\n12 3 0\n'))
+        f.close()
+        activ, = self.load().suspended_tasks[0].activations
+        self.assertEqual((activ.pc, activ.error_pc), (12, 0))
+        f = open(self.fn, 'w')
+        f.write(TASKDB.replace('\n12 3 12\n', '\n12 3\n'))
+        f.close()
+        activ, = self.load().suspended_tasks[0].activations
+        self.assertEqual((activ.pc, activ.error_pc), (12, 12))
+
+    def testCompact(self):
+        db = self.load()
+        db.set_property_value(5, 'description', 'A much longer description.')
+        db.checkpoint()
+        db.compact()
+        activ, = db.suspended_tasks[0].activations
+        self.assertEqual(db.read_program(activ.program),
+                         'call_function("suspend", 5);\nreturn 1;\n.\n')
+        self.assertEqual(db.read_program(db.queued_tasks[0].program),
+                         'return x;\n.\n')
+        self.assertEqual(db.connections, [(2, 0)])
+
+    def testSnapshot(self):
+        moo.db.LambdaMooDB(self.fn).load()
+        db = moo.db.LambdaMooDB(self.fn)
+        db.load()
+        self.assertEqual([task.id for task in db.suspended_tasks], [43])
+        self.assertEqual(db.connections, [(2, 0)])
+
+    def testRoundTrip(self):
+        out = os.path.join(self.tmpdir, 'out.db')
+        self.load().write(out)
+        self.assertEqual(open(out).read(), TASKDB)
+
+class WriterTests(DBTestFixture):
+    def read(self, fn):
+        f = open(fn)
+        try:
+            return f.read()
+        finally:
+            f.close()
+
+    def testRoundTrip(self):
+        out = os.path.join(self.tmpdir, 'out.db')
+        for reader in ('file', 'mmap'):
+            self.load(reader=reader).write(out)
+            self.assertEqual(self.read(out), MINIDB)
+        moo.dbwriter.write_database(self.load(), out, bufsize=16)
+        self.assertEqual(self.read(out), MINIDB)
+        moo.db.LambdaMooDB(self.fn).load()
+        db = moo.db.LambdaMooDB(self.fn)
+        db.load()
+        db.write(out)
+        self.assertEqual(self.read(out), MINIDB)
+
+    def testModified(self):
+        db = self.load()
+        db.set_property_value(5, 'description', 'A \'new\' thing.')
+        db.objects[3].properties[0].value = (moo.db.ObjRef(2), [], 0.1, None)
+        db.objects[0].verbs[0].body = 'return 2;'
+        db.write(self.fn)
+        db = self.load()
+        self.assertEqual(db.get_property_value(5, 'description'),
+                         'A \'new\' thing.')
+        self.assertEqual(db.objects[3].properties[0].value,
+                         [2, [], 0.1, None])
+        self.assertEqual(db.objects[0].verbs[0].body, 'return 2;\n.\n')
+        self.assertEqual(db.objects[3].verbs[0].body,
+                         'player:tell(this.description);\n'
+                         'return this.exits;\n.\n')
+        self.assertEqual(sorted(db.objects), [0, 1, 2, 3, 5])
+
+    def testBadValue(self):
+        db = self.load()
+        db.objects[0].properties[0].value = object()
+        out = os.path.join(self.tmpdir, 'out.db')
+        self.assertRaises(ValueError, db.write, out)
+        self.failIf(os.path.exists(out + '.tmp'))
+
+class SQLiteTests(DBTestFixture):
+    def export(self):
+        import sqlite3
+        out = os.path.join(self.tmpdir, 'mini.sqlite')
+        self.load().export_sqlite(out)
+        self.failIf(os.path.exists(out + '.tmp'))
+        return sqlite3.connect(out)
+
+    def testTables(self):
+        conn = self.export()
+        self.assertEqual(conn.execute(
+            'SELECT id FROM objects WHERE location = 3 ORDER BY id'
+            ).fetchall(), [(2,), (5,)])
+        self.assertEqual(conn.execute(
+            'SELECT object, body FROM verbs WHERE name = ?', ('l*ook',)
+            ).fetchall(), [(3, 'player:tell(this.description);\n'
+                                'return this.exits;\n.\n')])
+        self.assertEqual(conn.execute(
+            'SELECT object, inherited FROM properties WHERE name = ? '
+            'ORDER BY object', ('description',)).fetchall(),
+                         [(0, 1), (1, 0), (2, 1), (3, 1), (5, 1)])
+        indexes = [row[0] for row in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index'")]
+        for name in ('objects_owner', 'objects_parent', 'objects_location',
+                     'verbs_name'):
+            self.assert_(name in indexes)
+
+    def testValues(self):
+        conn = self.export()
+        valueid, = conn.execute(
+            'SELECT value FROM properties WHERE object = 3 AND slot = 0'
+            ).fetchone()
+        self.assertEqual(conn.execute(
+            'SELECT type, number FROM "values" WHERE id = ?', (valueid,)
+            ).fetchone(), (moo.db.TYPE_LIST, 3))
+        rows = conn.execute(
+            'SELECT type, number, text, real FROM "values" WHERE list = ? '
+            'ORDER BY position', (valueid,)).fetchall()
+        self.assertEqual(rows, [(moo.db.TYPE_OBJ, 5, None, None),
+                                (moo.db.TYPE_LIST, 2, None, None),
+                                (moo.db.TYPE_FLOAT, None, None, 1.5)])
+        self.assertEqual(conn.execute(
+            'SELECT v.type FROM properties p JOIN "values" v '
+            'ON v.id = p.value WHERE p.object = 2').fetchone(),
+                         (moo.db.TYPE_CLEAR,))
+
+class CheckpointTests(DBTestFixture):
+    def change(self, db):
+        db.set_property_value(5, 'description', 'A changed thing.')
+        db.move(5, 2)
+        db.objects[0].verbs[0].body = 'return 2;\n.\n'
+        db.verbs_changed(0)
+
+    def testDirty(self):
+        db = self.load()
+        self.assertEqual(db.dirty, set())
+        self.change(db)
+        self.assertEqual(db.dirty, set([0, 2, 3, 5]))
+
+    def testDelta(self):
+        db = moo.db.LambdaMooDB(self.fn)
+        db.load()
+        self.change(db)
+        self.assertEqual(db.checkpoint(), 4)
+        self.assertEqual(db.checkpoint(), 0)
+        db.set_property_value(3, 'exits', [])
+        del db.objects[2].verbs[:]
+        db.mark_dirty(2)
+        self.assertEqual(db.checkpoint(), 2)
+        self.assertEqual(open(self.fn).read(), MINIDB)
+        loaded = moo.db.LambdaMooDB(self.fn)
+        loaded.load()
+        expected = os.path.join(self.tmpdir, 'expected.db')
+        out = os.path.join(self.tmpdir, 'out.db')
+        db.write(expected)
+        loaded.write(out)
+        self.assertEqual(open(out).read(), open(expected).read())
+        self.assertEqual(loaded.contents(2), (5,))
+        self.assertEqual(loaded.objects[0].verbs[0].body, 'return 2;\n.\n')
+
+    def testTornSegment(self):
+        db = self.load()
+        self.change(db)
+        db.checkpoint()
+        f = open(moo.checkpoint.delta_filename(self.fn), 'a')
+        f.write(moo.checkpoint.DeltaHeader % moo.checkpoint.DeltaVersion
+                + '1000\n0 0 0\n')
+        f.close()
+        loaded = moo.db.LambdaMooDB(self.fn)
+        loaded.load()
+        self.assertEqual(loaded.get_property_value(5, 'description'),
+                         'A changed thing.')
+
+    def testStaleBase(self):
+        db = self.load()
+        self.change(db)
+        db.checkpoint()
+        f = open(self.fn, 'a')
+        f.write('0 active connections\n')
+        f.close()
+        self.assertRaises(ValueError, moo.db.LambdaMooDB(self.fn).load)
+
+    def testCompact(self):
+        db = self.load()
+        self.change(db)
+        db.checkpoint()
+        db.compact()
+        self.failIf(os.path.exists(moo.checkpoint.delta_filename(self.fn)))
+        self.assertEqual(db.dirty, set())
+        self.assertEqual(db.objects[0].verbs[0].body, 'return 2;\n.\n')
+        self.assertEqual(db.objects[3].verbs[0].body,
+                         'player:tell(this.description);\n'
+                         'return this.exits;\n.\n')
+        loaded = self.load()
+        self.assertEqual(loaded.tail_offset, db.tail_offset)
+        for objid, obj in db.objects.items():
+            self.assertSameObject(loaded.objects[objid], obj)
+            for verb, expverb in zip(loaded.objects[objid].verbs, obj.verbs):
+                self.assertEqual(verb.program, expverb.program)
+
+class SnapshotTests(DBTestFixture):
+    def testRoundTrip(self):
+        expected = self.load().objects
+        moo.db.LambdaMooDB(self.fn).load()
+        self.assert_(os.path.exists(moo.snapshot.snapshot_filename(self.fn)))
+        db = moo.db.LambdaMooDB(self.fn)
+        self.assert_(moo.snapshot.load_snapshot(db))
+        self.assertEqual(db.playerNumbers, [2])
+        self.assertEqual(sorted(db.objects), sorted(expected))
+        for objid, obj in expected.items():
+            self.assertSameObject(db.objects[objid], obj)
+
+    def testStaleSnapshot(self):
+        moo.db.LambdaMooDB(self.fn).load()
+        f = open(self.fn, 'a')
+        f.write('0 active connections\n')
+        f.close()
+        self.failIf(moo.snapshot.load_snapshot(moo.db.LambdaMooDB(self.fn)))
+
+def GetTestSuite():
+    ts = []
+    for obj in globals().values():
+        try:
+            ts.append(obj.get_suite())
+        except:
+            pass
+    return unittest.TestSuite(ts)
+
+if __name__ == '__main__':
+    unittest.main()